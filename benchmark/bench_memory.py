@@ -0,0 +1,126 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# memory / throughput benchmark of loading a large save file
+# usage: python -m benchmark.bench_memory [x_max=300] [y_max=300]
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from hexgrid import gridcls, loadmap
+
+
+def label_x(_x):
+    "the text version of the _x coordinate (A..Z, AA, AB ...)"
+    ret = ""
+    while _x > 0:
+        _x, rem = divmod(_x - 1, 26)
+        ret = chr(0x41 + rem) + ret
+    return ret
+
+
+def make_save_lines(x_max, y_max, colors=6):
+    "a save file with a floor on every hexagon and a marker every 50"
+    lines = ["GRIDMAP 0.1", "<set>", f"{x_max}|{y_max}|60|bench", "<color>"]
+    lines += [f"#{i * 30:02X}{i * 30:02X}{i * 30:02X}" for i in range(colors)]
+    lines.append("<floor>")
+    item_lines = ["<item>"]
+    player_lines = ["<player>"]
+    for _x in range(1, x_max + 1):
+        str_x = label_x(_x)
+        for _y in range(1, y_max + 1):
+            lines.append(f"{str_x}{_y}|{(_x * 7 + _y) % colors}")
+            if (_x * y_max + _y) % 50 == 0:
+                item_lines.append(f"{len(item_lines)}|item|1|1|{str_x}{_y}")
+            if (_x * y_max + _y) % 50 == 25:
+                player_lines.append(
+                    f"{len(player_lines)}|pc|1|2|3|{str_x}{_y}")
+    return lines + item_lines + ["<user>"] + player_lines
+
+
+def bench_load(lines, cells, **kwargs):
+    "bytes per cell and rows per second of loading the save"
+    tracemalloc.start()
+    _t = time.perf_counter()
+    grid = loadmap.init_map_data(lines, **kwargs)
+    used = time.perf_counter() - _t
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del grid
+    return current / cells, peak / cells, len(lines) / used
+
+
+def bench_load_file(lines, **kwargs):
+    """lines per second of a full `loadmap.load_file` (no tracemalloc
+    overhead) and seconds of a lazy one reading only the <set>"""
+    with tempfile.NamedTemporaryFile("w", suffix=".hgdata", delete=False,
+                                     encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    try:
+        _t = time.perf_counter()
+        loadmap.load_file(file.name, lazy=False, **kwargs)
+        used = time.perf_counter() - _t
+        _t = time.perf_counter()
+        _ = loadmap.load_file(file.name, **kwargs)["<set>"].name
+        lazy_used = time.perf_counter() - _t
+    finally:
+        os.remove(file.name)
+    return len(lines) / used, lazy_used
+
+
+def bench_pos_parse(lines, repeat=1):
+    "labels parsed per second by `gridcls.Pos` (each label `repeat` times)"
+    start = lines.index("<floor>") + 1
+    end = lines.index("<item>")
+    labels = [line.split("|")[0] for line in lines[start:end]]
+    labels = labels[:len(labels) // repeat] * repeat
+    _t = time.perf_counter()
+    for label in labels:
+        gridcls.Pos(label)
+    used = time.perf_counter() - _t
+    return len(labels) / used
+
+
+def main(argv):
+    x_max = int(argv[0]) if len(argv) > 0 else 300
+    y_max = int(argv[1]) if len(argv) > 1 else 300
+    lines = make_save_lines(x_max, y_max)
+    cells = x_max * y_max
+    print(f"map {x_max}x{y_max}: {cells} cells, {len(lines)} lines")
+    print(f"Pos parse rate: {bench_pos_parse(lines):,.0f} labels/s (unique),"
+          f" {bench_pos_parse(lines, repeat=10):,.0f} labels/s (repeated)")
+    modes = [{}]
+    try:
+        loadmap.init_map_data([], columnar_mode=True)
+        modes.append({"columnar_mode": True})
+    except TypeError:
+        pass
+    for kwargs in modes:
+        per_cell, peak, rate = bench_load(lines, cells, **kwargs)
+        print(f"load {kwargs or 'default'}: {per_cell:,.1f} bytes/cell "
+              f"(peak {peak:,.1f}), {rate:,.0f} lines/s")
+        rate, lazy_used = bench_load_file(lines, **kwargs)
+        print(f"load_file {kwargs or 'default'}: {rate:,.0f} lines/s, "
+              f"lazy <set> only: {lazy_used * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
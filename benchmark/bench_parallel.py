@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# scaling of the parallel load of a large save file with the worker count
+# usage: python -m benchmark.bench_parallel [x_max=1000] [y_max=1000]
+#                                           [max workers=cpu count]
+
+import os
+import sys
+import tempfile
+import time
+
+from hexgrid import loadmap
+
+from .bench_memory import make_save_lines
+
+
+def bench_workers(path, workers):
+    "seconds of a full columnar load (1 worker: the serial load)"
+    _t = time.perf_counter()
+    if workers > 1:
+        loadmap.load_file(path, workers=workers, use_journal=False)
+    else:
+        loadmap.load_file(path, columnar_mode=True, lazy=False,
+                          use_journal=False)
+    return time.perf_counter() - _t
+
+
+def time_workers(max_workers, bench):
+    """yield (workers, seconds, speed-up over 1 worker, result) of
+    `bench(workers)` -> (seconds, result), for 1, 2, 4 ... and the max
+    workers"""
+    counts = [1]
+    while counts[-1] * 2 < max_workers:
+        counts.append(counts[-1] * 2)
+    if max_workers > 1:
+        counts.append(max_workers)
+    serial = None
+    for workers in counts:
+        used, result = bench(workers)
+        if serial is None:
+            serial = used
+        yield (workers, used, serial / used, result)
+
+
+def main(argv):
+    x_max = int(argv[0]) if len(argv) > 0 else 1000
+    y_max = int(argv[1]) if len(argv) > 1 else 1000
+    max_workers = int(argv[2]) if len(argv) > 2 else os.cpu_count() or 1
+    lines = make_save_lines(x_max, y_max)
+    with tempfile.NamedTemporaryFile("w", suffix=".hgdata", delete=False,
+                                     encoding="utf-8") as file:
+        file.write("\n".join(lines) + "\n")
+    print(f"map {x_max}x{y_max}: {len(lines)} lines, "
+          f"{os.path.getsize(file.name) / (1 << 20):.1f} MiB, "
+          f"{os.cpu_count()} cpus")
+    try:
+        for workers, used, speedup, _ in time_workers(
+                max_workers,
+                lambda workers: (bench_workers(file.name, workers), None)):
+            print(f"{workers} workers: {used:.3f}s "
+                  f"({len(lines) / used:,.0f} lines/s, x{speedup:.2f})")
+    finally:
+        os.remove(file.name)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# scaling of the tiled render of the whole map with the worker count
+# usage: python -m benchmark.bench_render [x_max=60] [y_max=60]
+#                                         [max workers=cpu count]
+
+import os
+import sys
+import time
+
+from hexgrid import create_grid_pic, loadmap
+
+from .bench_memory import make_save_lines
+from .bench_parallel import time_workers
+
+
+def bench_workers(grid, workers):
+    "(seconds, canvas) of a full render (1 worker: the serial render)"
+    canvas = create_grid_pic.MapCanvas(grid, workers=workers)
+    _t = time.perf_counter()
+    canvas.craete_map()
+    return (time.perf_counter() - _t, canvas)
+
+
+def main(argv):
+    x_max = int(argv[0]) if len(argv) > 0 else 60
+    y_max = int(argv[1]) if len(argv) > 1 else 60
+    max_workers = int(argv[2]) if len(argv) > 2 else os.cpu_count() or 1
+    grid = loadmap.init_map_data(make_save_lines(x_max, y_max),
+                                 columnar_mode=True)
+    width, height = grid["<set>"].size
+    print(f"map {x_max}x{y_max}: {width}x{height} px, "
+          f"{os.cpu_count()} cpus")
+    # the caches of the serial render (grid layer, tiles, stamps) are warm
+    bench_workers(grid, 1)[1].close()
+    serial = None   # the pixels of the serial render
+    for workers, used, speedup, canvas in time_workers(
+            max_workers, lambda workers: bench_workers(grid, workers)):
+        if serial is None:
+            serial = canvas.image.tobytes()
+        same = canvas.image.tobytes() == serial
+        canvas.close()
+        print(f"{workers} workers: {used:.3f}s "
+              f"({width * height / used / 1e6:.1f} Mpx/s, "
+              f"x{speedup:.2f}, identical: {same})")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
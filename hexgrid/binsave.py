@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# binary save file, all numbers are little-endian
+#
+#   header          8s magic (global_const.BINARY_SAVE_HEADER),
+#                   H major, H minor, I number of sections
+#   section table   per section: 12s tag, Q offset, Q size (bytes),
+#                   Q count (records, lines or strings)
+#   sections        8 bytes aligned
+#       <floor> <item> <player>   fixed-width records (the `columnar` dtypes),
+#                                 string fields are ids of <strings>
+#       <set> <color> <user>      utf-8 text, the lines of the text save file
+#       <strings>                 count + 1 I offsets into the utf-8 blob that
+#                                 follows them
+#
+# the file is mapped (copy on write), the record sections are used as numpy
+# arrays without copying
+
+import mmap
+import struct
+
+import numpy as np
+
+from . import global_const
+
+_HEADER = struct.Struct("<8sHHI")
+_ENTRY = struct.Struct("<12sQQQ")
+_ALIGN = 8
+
+RECORD_TAGS = ("<floor>", "<item>", "<player>")
+SECTION_TAGS = ("<set>", "<color>", "<floor>", "<item>", "<user>", "<player>")
+
+
+def is_binary(path):
+    "the file is a binary save file"
+    with open(path, "rb") as file:
+        return file.read(len(global_const.BINARY_SAVE_HEADER)) \
+            == global_const.BINARY_SAVE_HEADER
+
+
+def _records(section, strings, string_ids):
+    "the records of a section, string ids remapped into `strings`"
+    columns = section.get_columns()
+    array = columns.array.copy()
+    names = columns.codec.string_fields
+    if names and len(array):
+        # only the strings used by the rows
+        used = np.unique(np.concatenate([array[name] for name in names]))
+        own = columns.codec.strings.strings
+        remap = np.array([_intern(own[sid], strings, string_ids)
+                          for sid in used.tolist()], dtype=np.uint32)
+        for name in names:
+            array[name] = remap[np.searchsorted(used, array[name])]
+    return array
+
+
+def _intern(text, strings, string_ids):
+    sid = string_ids.get(text)
+    if sid is None:
+        sid = string_ids[text] = len(strings)
+        strings.append(text)
+    return sid
+
+
+def _strings_payload(strings):
+    blobs = [text.encode("utf-8") for text in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u4")
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    return offsets.tobytes() + b"".join(blobs)
+
+
+def write(file, grid, tags=SECTION_TAGS):
+    """write the sections of the grid (`gridcls.Grid`) to a file opened in
+    binary mode, sections other than the record ones are written as text
+    (any iterable of lines ending with '\\n')"""
+    strings = []
+    string_ids = {}
+    payloads = []   # (tag, bytes, count)
+    for tag in tags:
+        section = grid[tag]
+        if tag in RECORD_TAGS:
+            array = _records(section, strings, string_ids)
+            payloads.append((tag, array.tobytes(), len(array)))
+        else:
+            lines = [line[:-1] for line in section]
+            payloads.append(
+                (tag, "\n".join(lines).encode("utf-8"), len(lines)))
+    payloads.append(("<strings>", _strings_payload(strings), len(strings)))
+
+    major, minor = global_const.BINARY_SAVE_VERSION
+    offset = _HEADER.size + _ENTRY.size * len(payloads)
+    table = []
+    for tag, payload, count in payloads:
+        offset += -offset % _ALIGN
+        table.append(_ENTRY.pack(tag.encode("ascii"), offset, len(payload),
+                                 count))
+        offset += len(payload)
+    file.write(_HEADER.pack(global_const.BINARY_SAVE_HEADER, major, minor,
+                            len(payloads)))
+    file.write(b"".join(table))
+    position = _HEADER.size + _ENTRY.size * len(payloads)
+    for _, payload, _ in payloads:
+        file.write(b"\0" * (-position % _ALIGN))
+        position += -position % _ALIGN
+        file.write(payload)
+        position += len(payload)
+
+
+def read_counts(path):
+    "{tag: count} of the sections, only the section table is read"
+    with open(path, "rb") as file:
+        header = file.read(_HEADER.size)
+        magic, _, _, n_sections = _HEADER.unpack(header)
+        if magic != global_const.BINARY_SAVE_HEADER:
+            raise ValueError(f"'{path}' is not a binary save file")
+        table = file.read(_ENTRY.size * n_sections)
+    ret = {}
+    for index in range(n_sections):
+        tag, _, _, count = _ENTRY.unpack_from(table, _ENTRY.size * index)
+        ret[tag.rstrip(b"\0").decode("ascii")] = count
+    return ret
+
+
+def read(path, dtypes):
+    """map the binary save file, return ({tag: structured array or text
+    lines}, [strings])
+    `dtypes`: {tag: dtype} of the record sections"""
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, major, _, n_sections = _HEADER.unpack_from(buffer, 0)
+    if magic != global_const.BINARY_SAVE_HEADER:
+        raise ValueError(f"'{path}' is not a binary save file")
+    if major != global_const.BINARY_SAVE_VERSION[0]:
+        raise ValueError(f"unsupported binary save version {major}")
+    sections = {}
+    strings = []
+    for index in range(n_sections):
+        tag, offset, size, count = _ENTRY.unpack_from(
+            buffer, _HEADER.size + _ENTRY.size * index)
+        tag = tag.rstrip(b"\0").decode("ascii")
+        if tag in dtypes:
+            sections[tag] = np.frombuffer(
+                buffer, dtype=dtypes[tag], count=count,
+                offset=offset)
+        elif tag == "<strings>":
+            offsets = np.frombuffer(buffer, dtype="<u4", count=count + 1,
+                                    offset=offset).tolist()
+            start = offset + 4 * (count + 1)
+            strings = [
+                buffer[start + offsets[i]:start + offsets[i + 1]
+                       ].decode("utf-8") for i in range(count)
+            ]
+        elif count:
+            sections[tag] = buffer[offset:offset + size].decode(
+                "utf-8").split("\n")
+        else:
+            sections[tag] = []
+    return (sections, strings)
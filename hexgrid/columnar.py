@@ -0,0 +1,432 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# columnar (numpy) storage of the floor, item and player sections
+# the rows are kept in a structured array, string fields are interned into
+# a string table and only their ids are stored in the array
+
+import numpy as np
+
+from . import gridcls
+
+
+class StringTable:
+    "interned strings, the columns only keep the string id"
+
+    def __init__(self):
+        self.strings = []
+        self._ids = {}
+
+    @classmethod
+    def from_strings(cls, strings):
+        "the table of a list of strings, ids are the list indexes"
+        ret = cls()
+        ret.strings = list(strings)
+        # the first one wins if a string repeats
+        for sid in range(len(ret.strings) - 1, -1, -1):
+            ret._ids[ret.strings[sid]] = sid
+        return ret
+
+    def intern(self, text) -> int:
+        "get the id of the string, add it if it is new"
+        text = str(text)
+        sid = self._ids.get(text)
+        if sid is None:
+            sid = len(self.strings)
+            self._ids[text] = sid
+            self.strings.append(text)
+        return sid
+
+    def __getitem__(self, sid: int) -> str:
+        return self.strings[sid]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def _pos_columns(values):
+    "(xs, ys) of labels, `gridcls.Pos` or (_x, _y) pairs"
+    values = list(values)
+    if all(isinstance(value, str) for value in values):
+        return gridcls.labels_to_xy(values)
+    pairs = [value.pos_tuple if isinstance(value, gridcls.Pos)
+             else gridcls.label_to_xy(value) if isinstance(value, str)
+             else (int(value[0]), int(value[1])) for value in values]
+    return ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+
+
+class RowCodec:
+    "convert between `gridcls.Node.*` rows and records of the array"
+    dtype = None
+    string_fields = ()  # the columns holding string ids (`StringTable`)
+    line_fields = ()    # the fields of a save file line, in order
+
+    def __init__(self, strings: StringTable = None):
+        if strings is None:
+            strings = StringTable()
+        self.strings = strings
+
+    def encode(self, row) -> tuple:
+        "the record tuple of the row"
+        raise NotImplementedError()
+
+    def decode(self, record):
+        "the row of a record tuple (python values, not numpy scalars)"
+        raise NotImplementedError()
+
+    def parse(self, fields) -> tuple:
+        "the record tuple of the (unescaped) fields of a save file line"
+        raise NotImplementedError()
+
+    def parse_many(self, rows):
+        "the structured array of a batch of `parse` fields"
+        return np.array([self.parse(fields) for fields in rows],
+                        dtype=self.dtype)
+
+    def records_of_columns(self, columns, convert=None):
+        """the structured array of columns {name: values}, a 'pos' column
+        (labels, `gridcls.Pos` or (_x, _y)) may replace 'x' and 'y'
+        `convert`: {name: callable} applied once to every distinct value of
+            the columns that are not numeric (color names ...)"""
+        columns = dict(columns)
+        if "pos" in columns:
+            columns["x"], columns["y"] = _pos_columns(columns.pop("pos"))
+        convert = convert or {}
+        size = len(next(iter(columns.values()))) if columns else 0
+        ret = np.zeros(size, dtype=self.dtype)
+        for name in self.dtype.names:
+            if name not in columns:
+                raise ValueError(f"no '{name}' column")
+            values = columns[name]
+            if name in self.string_fields:
+                intern = self.strings.intern
+                ret[name] = [intern(value) for value in
+                             np.asarray(values, dtype=object).tolist()]
+                continue
+            values = np.asarray(values)
+            if values.dtype.kind not in "iufb":
+                # every distinct value is converted once
+                uniques, inverse = np.unique(values.astype(str),
+                                             return_inverse=True)
+                func = convert.get(name, int)
+                values = np.array([func(value) for value in uniques.tolist()],
+                                  dtype=np.int64)[inverse.ravel()]
+            ret[name] = values
+        return ret
+
+
+class FloorCodec(RowCodec):
+    dtype = np.dtype([("x", "<i4"), ("y", "<i4"), ("color", "<i4")])
+    line_fields = ("pos", "color")
+
+    def encode(self, row):
+        return (row.pos.point_x, row.pos.point_y, int(row.color))
+
+    def decode(self, record):
+        _x, _y, color = record
+        return gridcls.Node.Floor(pos=gridcls.Pos(_x, _y), color=color)
+
+    def parse(self, fields):
+        _x, _y = gridcls.label_to_xy(fields[0])
+        return (_x, _y, int(fields[1]))
+
+    def parse_many(self, rows):
+        # column by column, floors are most of the save file
+        rows = list(rows)
+        if any(len(fields) != 2 for fields in rows):
+            return super().parse_many(rows)
+        ret = np.empty(len(rows), dtype=self.dtype)
+        ret["x"], ret["y"] = gridcls.labels_to_xy(
+            [fields[0] for fields in rows])
+        ret["color"] = list(map(int, [fields[1] for fields in rows]))
+        return ret
+
+
+class ItemCodec(RowCodec):
+    string_fields = ("id", "name")
+    line_fields = ("id", "name", "color", "type", "pos")
+    dtype = np.dtype([
+        ("id", "<u4"), ("name", "<u4"), ("color", "<i4"), ("type", "<i4"),
+        ("x", "<i4"), ("y", "<i4")
+    ])
+
+    def encode(self, row):
+        intern = self.strings.intern
+        return (intern(row.id), intern(row.name), int(row.color),
+                int(row.type), row.pos.point_x, row.pos.point_y)
+
+    def decode(self, record):
+        item_id, name, color, stamp_type, _x, _y = record
+        return gridcls.Node.Item(
+            id=self.strings[item_id], name=self.strings[name], color=color,
+            type=stamp_type, pos=gridcls.Pos(_x, _y)
+        )
+
+    def parse(self, fields):
+        intern = self.strings.intern
+        _x, _y = gridcls.label_to_xy(fields[4])
+        return (intern(fields[0]), intern(fields[1]), int(fields[2]),
+                int(fields[3]), _x, _y)
+
+
+class PlayerCodec(RowCodec):
+    string_fields = ("id", "name", "uid")
+    line_fields = ("id", "name", "uid", "color", "type", "pos")
+    dtype = np.dtype([
+        ("id", "<u4"), ("name", "<u4"), ("uid", "<u4"), ("color", "<i4"),
+        ("type", "<i4"), ("x", "<i4"), ("y", "<i4")
+    ])
+
+    def encode(self, row):
+        intern = self.strings.intern
+        return (intern(row.id), intern(row.name), intern(row.uid),
+                int(row.color), int(row.type),
+                row.pos.point_x, row.pos.point_y)
+
+    def decode(self, record):
+        player_id, name, uid, color, stamp_type, _x, _y = record
+        return gridcls.Node.Player(
+            id=self.strings[player_id], name=self.strings[name],
+            uid=self.strings[uid], color=color, type=stamp_type,
+            pos=gridcls.Pos(_x, _y)
+        )
+
+    def parse(self, fields):
+        intern = self.strings.intern
+        _x, _y = gridcls.label_to_xy(fields[5])
+        return (intern(fields[0]), intern(fields[1]), intern(fields[2]),
+                int(fields[3]), int(fields[4]), _x, _y)
+
+
+class ColumnRows:
+    """list-like view of the rows kept in a structured numpy array, row
+    objects are only built when they are read"""
+
+    def __init__(self, codec: RowCodec, capacity=64):
+        self.codec = codec
+        self._array = np.zeros(max(int(capacity), 1), dtype=codec.dtype)
+        self._size = 0
+
+    @classmethod
+    def from_rows(cls, codec: RowCodec, rows):
+        "build the columns from row objects"
+        rows = list(rows)
+        ret = cls(codec, capacity=len(rows))
+        ret.extend_records(np.array(
+            [codec.encode(row) for row in rows], dtype=codec.dtype
+        ))
+        return ret
+
+    @classmethod
+    def from_array(cls, codec: RowCodec, array):
+        """use a structured array of records as the rows without copying it,
+        it is copied when the rows grow"""
+        ret = cls(codec)
+        ret._array = array
+        ret._size = len(array)
+        return ret
+
+    @property
+    def nbytes(self):
+        "bytes used by the array (with the room reserved to grow)"
+        return self._array.nbytes
+
+    @property
+    def array(self):
+        "the structured array of all the rows (a view, not a copy)"
+        return self._array[:self._size]
+
+    def column(self, name):
+        "a single column, string columns are decoded"
+        col = self.array[name]
+        if name in self.codec.string_fields:
+            strings = self.codec.strings.strings
+            return [strings[sid] for sid in col.tolist()]
+        return col
+
+    def _reserve(self, size):
+        if size <= len(self._array):
+            return
+        new_array = np.zeros(max(size, len(self._array) * 2),
+                             dtype=self._array.dtype)
+        new_array[:self._size] = self._array[:self._size]
+        self._array = new_array
+
+    def _check_index(self, index):
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError(index)
+        return index
+
+    def append(self, row):
+        self._reserve(self._size + 1)
+        self._array[self._size] = self.codec.encode(row)
+        self._size += 1
+
+    def extend_records(self, records):
+        "append a structured array (or list of record tuples) at once"
+        records = np.asarray(records, dtype=self._array.dtype)
+        self._reserve(self._size + len(records))
+        self._array[self._size:self._size + len(records)] = records
+        self._size += len(records)
+
+    def pop(self):
+        index = self._check_index(-1)
+        ret = self.codec.decode(self._array[index].tolist())
+        self._size -= 1
+        return ret
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.codec.decode(rec)
+                    for rec in self.array[index].tolist()]
+        index = self._check_index(index)
+        return self.codec.decode(self._array[index].tolist())
+
+    def __setitem__(self, index, row):
+        index = self._check_index(index)
+        self._array[index] = self.codec.encode(row)
+
+    def __iter__(self):
+        decode = self.codec.decode
+        step = 4096
+        for start in range(0, self._size, step):
+            # tolist is much faster than reading the records one by one
+            for rec in self._array[start:min(start + step, self._size)
+                                   ].tolist():
+                yield decode(rec)
+
+
+class DensePosIndex:
+    """(_x, _y) -> row index kept in a 2d int32 array (4 bytes per hexagon
+    instead of a dict entry), it grows with the positions set
+
+    the array starts at `origin` (the part of the map held), positions
+    below it fall back to a dict"""
+
+    def __init__(self, shape=(0, 0), origin=(0, 0)):
+        self._array = np.full(shape, -1, dtype=np.int32)
+        self._others = {}
+        self.origin = (int(origin[0]), int(origin[1]))
+
+    @classmethod
+    def from_columns(cls, xs, ys, origin=(0, 0)):
+        "index every row, the last one wins if positions repeat"
+        ret = cls(origin=origin)
+        ret.set_rows(xs, ys)
+        return ret
+
+    @property
+    def nbytes(self):
+        "bytes used by the array"
+        return self._array.nbytes
+
+    def set_rows(self, xs, ys, start=0):
+        "index the rows start, start + 1 ... at once, the last one wins"
+        xs = np.asarray(xs) - self.origin[0]
+        ys = np.asarray(ys) - self.origin[1]
+        if len(xs) == 0:
+            return
+        inside = (xs >= 0) & (ys >= 0)
+        self._reserve(int(xs[inside].max(initial=0)),
+                      int(ys[inside].max(initial=0)))
+        rows = np.arange(start, start + len(xs), dtype=np.int32)
+        # numpy does not say which value of a repeated index is assigned,
+        # the greatest row is kept explicitly
+        cells = (xs[inside], ys[inside])
+        self._array[cells] = -1
+        np.maximum.at(self._array, cells, rows[inside])
+        for row in np.nonzero(~inside)[0].tolist():
+            self._others[(int(xs[row]) + self.origin[0],
+                          int(ys[row]) + self.origin[1])] = start + row
+
+    def _reserve(self, _x, _y):
+        shape = self._array.shape
+        if _x < shape[0] and _y < shape[1]:
+            return
+        new_shape = list(shape)
+        if _x >= shape[0]:
+            new_shape[0] = max(_x + 1, shape[0] * 3 // 2)
+        if _y >= shape[1]:
+            new_shape[1] = max(_y + 1, shape[1] * 3 // 2)
+        new_array = np.full(new_shape, -1, dtype=np.int32)
+        new_array[:shape[0], :shape[1]] = self._array
+        self._array = new_array
+
+    def _local(self, key):
+        "the position in the array (None if it is below the origin)"
+        _x = key[0] - self.origin[0]
+        _y = key[1] - self.origin[1]
+        if _x < 0 or _y < 0:
+            return None
+        return (_x, _y)
+
+    def _inside(self, local):
+        return (local[0] < self._array.shape[0]
+                and local[1] < self._array.shape[1])
+
+    def get(self, key, default=None):
+        local = self._local(key)
+        if local is None:
+            return self._others.get(key, default)
+        if not self._inside(local):
+            return default
+        ret = int(self._array[local[0], local[1]])
+        if ret < 0:
+            return default
+        return ret
+
+    def get_many(self, xs, ys):
+        "the row indexes of many positions at once (-1 if not indexed)"
+        xs = np.asarray(xs, dtype=np.int64) - self.origin[0]
+        ys = np.asarray(ys, dtype=np.int64) - self.origin[1]
+        ret = np.full(len(xs), -1, dtype=np.int64)
+        inside = (xs >= 0) & (ys >= 0) & (xs < self._array.shape[0]) \
+            & (ys < self._array.shape[1])
+        ret[inside] = self._array[xs[inside], ys[inside]]
+        for row in np.nonzero((xs < 0) | (ys < 0))[0].tolist():
+            ret[row] = self._others.get((int(xs[row]) + self.origin[0],
+                                         int(ys[row]) + self.origin[1]), -1)
+        return ret
+
+    def pop(self, key, default=None):
+        ret = self.get(key, default)
+        local = self._local(key)
+        if local is None:
+            self._others.pop(key, None)
+        elif self._inside(local):
+            self._array[local[0], local[1]] = -1
+        return ret
+
+    def __setitem__(self, key, value):
+        local = self._local(key)
+        if local is None:
+            self._others[key] = value
+            return
+        self._reserve(local[0], local[1])
+        self._array[local[0], local[1]] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return int(np.count_nonzero(self._array >= 0)) + len(self._others)
@@ -19,10 +19,11 @@
 import cmd
 import os
 import platform
+import re
 import time
 
 from . import (__version__, create_grid_pic, global_const, gridcls, loadmap,
-               misc)
+               misc, tiles)
 
 system = platform.system()
 FLAG_GUI: bool = False
@@ -47,7 +48,6 @@ Use 'help' to see help ...\
         super().__init__(completekey, stdin, stdout)
         self.data = None
         self.mapcanvas = None
-        self.tmp_action_list = []
         self.log = misc.LogCls()
 
     def emptyline(self):
@@ -67,7 +67,7 @@ Use 'help' to see help ...\
         mapconf = gridcls.Node.Set(
             x_max=int(default_arg[0]),
             y_max=int(default_arg[1]),
-            _r=30,
+            _r=global_const.PX_R,
             name=default_arg[2]
         )
         self.data["<set>"].set_data(mapconf)
@@ -75,8 +75,19 @@ Use 'help' to see help ...\
         self.log.info("new map created")
 
     def do_load(self, arg: str):
-        "load [path]|'tk'"
+        """load [path]|'tk' [--columnar] [--workers n]
+        --columnar: keep floors, items and players in numpy arrays \
+(for huge maps)
+        --workers: parse the big sections in n processes (columnar)"""
         # print(arg.split())
+        columnar_mode = "--columnar" in arg.split()
+        if columnar_mode:
+            arg = arg.replace("--columnar", "").strip()
+        workers = None
+        match = re.search(r"--workers\s+(\d+)", arg)
+        if match is not None:
+            workers = int(match.group(1))
+            arg = (arg[:match.start()] + arg[match.end():]).strip()
         arg_lst = arg.split()
         if self.data is not None:
             self.do_clear(None)
@@ -101,12 +112,20 @@ terminal line instead")
         if path == "":
             self.log.info("cancelled")
             return
-        if not os.path.isfile(path):
+        if os.path.isdir(path):
+            if not os.path.isfile(os.path.join(path, tiles.META_FILE)):
+                self.log.error(f"'{path}' is not a tiled map. abort")
+                return
+        elif not os.path.isfile(path):
             self.log.error(f"input path '{path}' is not a file. abort")
             return
         self.log.info("- load start -")
         _t = time.time()
-        self.data = loadmap.load_file(path)
+        if os.path.isdir(path):
+            self.data = tiles.open_tiles(path)
+        else:
+            self.data = loadmap.load_file(path, columnar_mode=columnar_mode,
+                                           log=self.log, workers=workers)
         self.mapcanvas = create_grid_pic.MapCanvas(self.data)
         self.log.info("time used: {0}", time.time() - _t)
         # color_print(f"time used - {time.time()-_t}", lvl=2)
@@ -164,16 +183,12 @@ type-{player.type}")
     def do_clear(self, _=None):
         if self.data is not None:
             self.data = None
-            self.tmp_action_list = []
             self.log.info("load cleared")
         if self.mapcanvas is None:
             # self.log.debug("map unload")
             return
-        if not self.mapcanvas.map_created:
-            self.mapcanvas = None
-        else:
-            self.mapcanvas.image.close()
-            self.mapcanvas = None
+        self.mapcanvas.close()
+        self.mapcanvas = None
         self.log.info("map cleared")
 
     def do_preview(self, *_):
@@ -186,12 +201,8 @@ type-{player.type}")
                 "preview may not work in this system (gui required)")
         self.log.info("- preview start -")
         _t = time.time()
-        if not self.mapcanvas.map_created:
-            self.mapcanvas.craete_map()
-            self.tmp_action_list = []
-        if self.tmp_action_list:
-            for pos_conf in self.tmp_action_list:
-                self.mapcanvas.draw_from_pos_conf(pos_conf=pos_conf)
+        # only the hexagons edited since the last picture are painted again
+        self.mapcanvas.refresh()
         img = self.mapcanvas.output()
         # img.show()
         self.log.info(f"time used: {time.time() - _t}")
@@ -219,17 +230,12 @@ add [type <'item'|'floor'|'player'>] [Pos: str "A0"] ...
             color_raw = arg[2]
             color_id = None
             if color_raw.startswith("#"):
-                if color_raw in self.data["<color>"]:
-                    color_id = self.data["<color>"].index(color_raw)
-                else:
-                    color_id = self.data["<color>"].add_color(color_raw)
+                color_id = self.data["<color>"].add_color(color_raw)
             elif color_raw.isalnum():
                 color_id = int(color_raw)
             floor_elem = gridcls.Node.Floor(pos, color_id)
-            pos_conf = self.data.get_pos(pos)
+            # the pos index of the grid and the canvas follow set_on_pos
             self.data["<floor>"].set_on_pos(pos, floor_elem)
-            pos_conf.floor = floor_elem
-            self.tmp_action_list.append(pos_conf)
 
         elif arg[0] == "item":
             if len(arg) <= 4:
@@ -285,9 +291,72 @@ add [type <'item'|'floor'|'player'>] [Pos: str "A0"] ...
                 color, string = colorchooser.askcolor("#FF0000")
                 self.log.debug("color choosed - {0}: {1}", string, color)
 
+    def do_import(self, arg: str):
+        """import <'floor'|'item'|'player'> path.csv
+    add many rows from a CSV file at once, the columns are the fields of \
+the save file lines (a first row may name them, 'x' and 'y' may replace \
+'pos'), colors are ids or #rgb, item and player ids are optional with \
+named columns"""
+        if self.data is None:
+            self.log.error("please load the map first")
+            return
+        arg_lst = arg.split(maxsplit=1)
+        if len(arg_lst) < 2 or arg_lst[0] not in ("floor", "item", "player"):
+            self.log.error("Input ERROR")
+            self.do_help("import")
+            return
+        path = arg_lst[1].strip()
+        if not os.path.isfile(path):
+            self.log.error(f"input path '{path}' is not a file. abort")
+            return
+        _t = time.time()
+        try:
+            count = self.data.import_rows(f"<{arg_lst[0]}>", path)
+        except ValueError as err:
+            self.log.error(f"cannot import '{path}': {err}")
+            return
+        self.log.info("imported {0} {1} rows in {2:.3f}s", count, arg_lst[0],
+                      time.time() - _t)
+
     def do_save(self, arg: str):
-        "save the map file"
+        """save [--path path] [--binary | --tiles [size]] \
+[--compress gzip|bz2|lzma] [--runs]
+        --binary: save in the binary format (fast to load, mapped in \
+columnar mode)
+        --compress: compress the text save file (found when it is loaded)
+        --runs: save the floors as runs of a column (much smaller for \
+dense maps)
+        --tiles: save as a new tiled map directory (tiles of size x size \
+hexagons, default 64), once loaded only its changed tiles are saved
+        saving to the loaded file only appends the edits to its journal \
+(path.journal), the file is rewritten when the journal grows too big"""
         arg_lst = arg.split()
+        binary = "--binary" in arg_lst
+        if binary:
+            arg_lst.remove("--binary")
+        floor_runs = "--runs" in arg_lst
+        if floor_runs:
+            arg_lst.remove("--runs")
+        compress = None
+        if "--compress" in arg_lst:
+            index = arg_lst.index("--compress")
+            if index + 1 >= len(arg_lst) or \
+                    arg_lst[index + 1] not in misc.COMPRESSIONS:
+                self.log.error(f"--compress needs one of \
+{', '.join(misc.COMPRESSIONS)}. abort")
+                return
+            compress = arg_lst.pop(index + 1)
+            arg_lst.pop(index)
+        if binary and compress is not None:
+            self.log.error("binary saves cannot be compressed. abort")
+            return
+        tile_size = None
+        if "--tiles" in arg_lst:
+            index = arg_lst.index("--tiles")
+            tile_size = 64
+            if index + 1 < len(arg_lst) and arg_lst[index + 1].isdigit():
+                tile_size = int(arg_lst.pop(index + 1))
+            arg_lst.pop(index)
         if "--path" in arg_lst:
             path_index = arg_lst.index("--path")
             path = arg_lst[path_index + 1]
@@ -310,10 +379,27 @@ terminal line instead")
         if path == "":
             self.log.info("cancelled")
             return
-        self.data.save(path)
+        if tile_size is not None:
+            try:
+                tiles.save_tiles(self.data, path, tile_size=tile_size)
+            except FileExistsError:
+                self.log.error(f"'{path}' is already a tiled map. abort")
+            return
+        self.data.save(path, binary=binary, compress=compress,
+                       floor_runs=floor_runs)
 
     def do_render(self, arg: str):
-        "render the map picture (.png) and save it"
+        """render [--path path] [--raw] [--workers n] [--bands]
+        render the map picture (.png) and save it
+        --raw: full size
+        --workers: paint the whole map in tiles in n processes
+        --bands: paint it band by band into the file, without the picture \
+of the whole map in memory (for huge maps)"""
+        workers = None
+        match = re.search(r"--workers\s+(\d+)", arg)
+        if match is not None:
+            workers = int(match.group(1))
+            arg = (arg[:match.start()] + arg[match.end():]).strip()
         arg_lst = arg.split()
         if "--path" in arg_lst:
             path_index = arg_lst.index("--path")
@@ -345,12 +431,16 @@ terminal line instead")
             self.log.error("please load file first")
             return
         _t = time.time()
-        if not self.mapcanvas.map_created:
-            self.mapcanvas.craete_map()
-            self.tmp_action_list = []
-        if self.tmp_action_list:
-            for pos_conf in self.tmp_action_list:
-                self.mapcanvas.draw_from_pos_conf(pos_conf=pos_conf)
+        if "--bands" in arg_lst:
+            create_grid_pic.export_bands(
+                self.data, path, half="--raw" not in arg_lst,
+                workers=workers or 1,
+                palette_stamps=self.mapcanvas.palette_stamps)
+            self.log.info(f"time used - {time.time()-_t}")
+            return
+        if workers is not None:
+            self.mapcanvas.workers = workers
+        self.mapcanvas.refresh()
         if "--raw" in arg_lst:
             img = self.mapcanvas.image.convert("RGB")
             img.save(path)
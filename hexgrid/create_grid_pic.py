@@ -16,26 +16,318 @@
    limitations under the License.
 """
 
-from os.path import isfile
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 from typing import overload
 
+import numpy as np
 from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
 
-from . import global_const, gridcls
+from . import columnar, geometry, global_const, gridcls, misc, pngstream
 
 
-class MapCanvas:
-    "the total canvas class"
+def title_font_size(radius):
+    "the font size of the titles, scaled with the hexagon radius"
+    return max(1, round(
+        global_const.FONT_TITLE_SIZE * radius / global_const.PX_R))
 
-    def __init__(self, data: gridcls.Grid):
+
+# the fields of the rows painted in each layer
+LAYER_FIELDS = {"<floor>": ("color",), "<item>": ("type", "color", "id"),
+                "<player>": ("type", "color", "id")}
+
+
+def cell_range(box, radius):
+    """(x start, x stop, y start, y stop) of the hexagons whose floor, outline
+    or marker may be drawn in the pixel box"""
+    left, upper, right, lower = box
+    width = 1.5 * radius
+    height = 2 * global_const.PX_RATIO * radius
+    return (int(left // width) - 2, int(right // width) + 3,
+            int(upper // height) - 1, int(lower // height) + 3)
+
+
+def sorted_rows(section, names):
+    """{name: column} of x, y and `names` of the rows of the section in
+    (x, y) order (the order the overlapping hexagons are painted in), the
+    columns are numpy arrays, or lists for the string fields
+    the section is read part by part (`iter_columns`, a tile at a time on a
+    tiled map), only the painted columns of each part are kept"""
+    parts = []
+    for columns in section.iter_columns():
+        # copies, the part (a tile of the LRU) is not kept alive by views
+        part = {"x": columns.array["x"].copy(),
+                "y": columns.array["y"].copy()}
+        for name in names:
+            column = columns.column(name)
+            part[name] = column if isinstance(column, list) else \
+                column.copy()
+        parts.append(part)
+    if not parts:
+        columns = columnar.ColumnRows(section.codec_cls())
+        parts.append({name: columns.column(name)
+                      for name in ("x", "y") + tuple(names)})
+    _xs = np.concatenate([part["x"] for part in parts])
+    _ys = np.concatenate([part["y"] for part in parts])
+    order = np.lexsort((_ys, _xs))    # stable
+    if len(order) > 1:
+        # only the last row of a pos is on the map (see `get_on_pos`)
+        sorted_xs, sorted_ys = _xs[order], _ys[order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = (sorted_xs[1:] != sorted_xs[:-1]) \
+            | (sorted_ys[1:] != sorted_ys[:-1])
+        order = order[last]
+    ret = {"x": _xs[order], "y": _ys[order]}
+    for name in names:
+        if isinstance(parts[0][name], list):
+            column = [value for part in parts for value in part[name]]
+            ret[name] = [column[index] for index in order.tolist()]
+        else:
+            ret[name] = np.concatenate(
+                [part[name] for part in parts])[order]
+    return ret
+
+
+class GridSnapshot:
+    """what the painters read of a `Grid`: the settings, the colors used and
+    the painted rows in sorted numpy columns, small to send to the worker
+    processes (`render_tiles`)
+    `palette_stamps`: see `MapCanvas`"""
+
+    def __init__(self, data: gridcls.Grid, palette_stamps=False):
+        setting = data["<set>"]
+        self.x_max = setting.x_max
+        self.y_max = setting.y_max
+        self.radius = setting.radius
+        self.size = setting.size
+        self.layers = {}
+        for tag, names in LAYER_FIELDS.items():
+            rows = sorted_rows(data[tag], names)
+            for name in names:
+                if isinstance(rows[name], list):
+                    column = np.empty(len(rows[name]), dtype=object)
+                    column[:] = rows[name]
+                    rows[name] = column
+            self.layers[tag] = rows
+        used = [self.layers["<floor>"]["color"]]
+        if palette_stamps:
+            used += [self.layers[tag]["color"]
+                     for tag in ("<item>", "<player>")]
+        palette = data["<color>"]
+        self.colors = {color_id: palette.get_rgba(color_id)
+                       for color_id in set(np.concatenate(used).tolist())}
+
+    def get_rgba(self, color_id):
+        "the (r, g, b, a) of a color used on the map"
+        return self.colors[int(color_id)]
+
+    def rows(self, tag, names, cells=None):
+        """the `sorted_rows` of the section, all of them or the ones of the
+        hexagons in `cells` (see `cell_range`)"""
+        rows = self.layers[tag]
+        if cells is None:
+            index = slice(None)
+        else:
+            x_start, x_stop, y_start, y_stop = cells
+            start, stop = np.searchsorted(rows["x"], (x_start, x_stop))
+            _ys = rows["y"][start:stop]
+            index = start + np.flatnonzero((_ys >= y_start) & (_ys < y_stop))
+        ret = {"x": rows["x"][index], "y": rows["y"][index]}
+        for name in names:
+            ret[name] = rows[name][index].tolist()
+        return ret
+
+
+class MapPainter:
+    """paints the layers of the map (floor, grid, item and player, from the
+    bottom) in pixel boxes, from a `Grid` or a `GridSnapshot`
+    `palette_stamps`: see `MapCanvas`"""
+
+    def __init__(self, data, palette_stamps=False):
         self.grid_data = data
-        self.map_created = False    # lazy create
-        self.image = Image.new(
-            mode="RGBA", size=self.grid_data["<set>"].size,
-            color=(255, 255, 255, 255))
+        self.palette_stamps = palette_stamps
+        self.radius = self._section("<set>").radius
         self._font_title = ImageFont.truetype(
-            global_const.FONT_TITLE_PATH, size=global_const.FONT_TITLE_SIZE)
-        self._draw = ImageDraw.Draw(self.image, mode="RGBA")
+            global_const.FONT_TITLE_PATH, size=title_font_size(self.radius))
+
+    def _section(self, tag):
+        # a snapshot stands for the settings and the colors of its map
+        if isinstance(self.grid_data, GridSnapshot):
+            return self.grid_data
+        return self.grid_data[tag]
+
+    def _paste_floors(self, points, colors, image, offset=(0, 0)):
+        """fill the hexagons of the points (n, 7, 2) and outline them
+        `image`: the part of the canvas whose left-top is `offset`"""
+        if len(points) == 0:
+            return
+        origins, phase_ids, phases = HEX_TILES.phases(points)
+        origins -= offset
+        image = image.im
+        pasted = {}     # (phase id, color): (tile, mask, width, height)
+        for (_x, _y), phase_id, color in zip(origins.tolist(),
+                                             phase_ids.tolist(), colors):
+            key = (phase_id, color)
+            tile = pasted.get(key)
+            if tile is None:
+                tile, mask = HEX_TILES.get(phases[phase_id], color)
+                tile = pasted[key] = (tile.im, mask.im) + tile.size
+            # skip the checks of Image.paste per tile
+            image.paste(tile[0], (_x, _y, _x + tile[2], _y + tile[3]),
+                        tile[1])
+
+    def _draw_floors(self, image, box=None):
+        palette = self._section("<color>")
+        rows = self._layer_rows("<floor>", LAYER_FIELDS["<floor>"], box)
+        points = geometry.polygons(rows["x"], rows["y"], self.radius)
+        self._paste_floors(points, [palette.get_rgba(color_id)
+                                    for color_id in rows["color"]],
+                           image, (0, 0) if box is None else box[:2])
+
+    def _draw_map_grid(self, image, box=None):
+        setting = self._section("<set>")
+        layer = make_grid_layer(setting.x_max, setting.y_max, self.radius,
+                                self._font_title, box)
+        image.paste((0, 0, 0, 255), box=(0, 0), mask=layer)
+
+    def _paste_stamp(self, stamp_type, stamp_color_id, *, paste_bbox,
+                     text_xy, target, text=None, mask_alpha=None):
+        "`target`: (image, draw) to paste on"
+        image, draw = target
+        if mask_alpha is None:
+            mask_alpha = 0x7d
+        color = stamp_color_id
+        if self.palette_stamps:
+            color = self._section("<color>").get_rgba(stamp_color_id)
+        stm, mask = SPRITES.get(stamp_type, color,
+                                geometry.stamp_size(self.radius), mask_alpha)
+        image.paste(stm, box=paste_bbox, mask=mask)
+        if text is not None:
+            draw.text(text_xy, text=text[0], font=self._font_title,
+                      anchor="mm", fill=text[1])
+
+    def _draw_stamps(self, tag, prefix, image, mask_alpha=None, box=None):
+        "draw all the items (or players) with the batch geometry"
+        rows = self._layer_rows(tag, LAYER_FIELDS[tag], box)
+        boxes = geometry.paste_boxes(rows["x"], rows["y"], self.radius)
+        text_xys = geometry.centers(rows["x"], rows["y"], self.radius)
+        titles = [f"{prefix}-{marker_id}" for marker_id in rows["id"]]
+        if box is not None:
+            boxes -= box[:2]
+            text_xys -= box[:2]
+            # only the markers whose stamp or title (no glyph is wider than
+            # the font size) may reach into the box
+            width, height = box[2] - box[0], box[3] - box[1]
+            size = geometry.stamp_size(self.radius)
+            font_size = self._font_title.size
+            _w = font_size / 2 * np.array([len(title) for title in titles],
+                                          dtype=np.int64) + 2
+            stamp_in = ((boxes < (width, height))
+                        & (boxes + size > 0)).all(axis=1)
+            title_in = (text_xys[:, 0] - _w < width) \
+                & (text_xys[:, 0] + _w > 0) \
+                & (text_xys[:, 1] - font_size - 2 < height) \
+                & (text_xys[:, 1] + font_size + 2 > 0)
+            keep = stamp_in | title_in
+            index = np.flatnonzero(keep).tolist()
+            rows = {name: [rows[name][i] for i in index]
+                    for name in ("type", "color")}
+            boxes, text_xys = boxes[index], text_xys[index]
+            titles = [titles[i] for i in index]
+        target = (image, ImageDraw.Draw(image, mode="RGBA"))
+        for stamp_type, color_id, title, paste_box, text_xy in zip(
+                rows["type"], rows["color"], titles, boxes.tolist(),
+                text_xys.tolist()):
+            self._paste_stamp(
+                stamp_type, color_id, paste_bbox=tuple(paste_box),
+                text_xy=tuple(text_xy), target=target,
+                text=(title, (0xff, 0xff, 0xff, 0xff)),
+                mask_alpha=mask_alpha)
+
+    def _draw_items(self, image, box=None):
+        self._draw_stamps("<item>", "i", image, box=box)
+
+    def _draw_players(self, image, box=None):
+        self._draw_stamps("<player>", "p", image, mask_alpha=0xff, box=box)
+
+    def _layer_rows(self, tag, names, box=None):
+        """{name: column} of x, y and `names` of the rows of the section in
+        (x, y) order (the order the overlapping hexagons are painted in),
+        all of them or the ones that may be drawn in the box
+        both pick the row `get_on_pos` gives (the sections keep only the last
+        row of a pos), a repaint of a box draws what a full render does"""
+        cells = None if box is None else cell_range(box, self.radius)
+        if isinstance(self.grid_data, GridSnapshot):
+            return self.grid_data.rows(tag, names, cells)
+        section = self.grid_data[tag]
+        if box is not None:
+            x_start, x_stop, y_start, y_stop = cells
+            rows = [row for row in map(section.get_on_pos, (
+                (_x, _y) for _x in range(x_start, x_stop)
+                for _y in range(y_start, y_stop))) if row is not None]
+            ret = {name: [getattr(row, name) for row in rows]
+                   for name in names}
+            ret["x"] = np.array([row.pos.point_x for row in rows],
+                                dtype=np.int64)
+            ret["y"] = np.array([row.pos.point_y for row in rows],
+                                dtype=np.int64)
+            return ret
+        ret = sorted_rows(section, names)
+        for name in names:
+            if not isinstance(ret[name], list):
+                ret[name] = ret[name].tolist()
+        return ret
+
+    def paint(self, box):
+        "the RGBA picture of the layers in the box"
+        image = Image.new("RGBA", (box[2] - box[0], box[3] - box[1]),
+                          color=(255, 255, 255, 255))
+        self._draw_floors(image, box)
+        self._draw_map_grid(image, box)
+        self._draw_items(image, box)
+        self._draw_players(image, box)
+        return image
+
+
+class MapCanvas(MapPainter):
+    """the total canvas class, painted in layers (floor, grid, item and
+    player, from the bottom), once drawn it follows the edits of the map:
+    the hexagons changed are marked dirty in their layer and `refresh`
+    paints them again
+    `palette_stamps`: the color ids of the items and players are ids of the
+        map colors (`<color>`) instead of the built-in stamp colors
+    `workers`: the whole map is painted in tiles by this many processes"""
+    LAYERS = ("floor", "grid", "item", "player")
+    _TAG_LAYERS = {"<floor>": "floor", "<item>": "item", "<player>": "player"}
+
+    def __init__(self, data: gridcls.Grid, palette_stamps=False, workers=1):
+        super().__init__(data, palette_stamps)
+        self.workers = workers
+        self.map_created = False    # lazy create
+        self.size = self.grid_data["<set>"].size
+        self._image = None  # see `image`
+        self._image_draw = None
+        # the pixel boxes to paint again, by layer
+        self.dirty = {layer: set() for layer in self.LAYERS}
+        self._dirty_area = 0    # the whole map is painted again above half
+        data.add_listener(self._on_change)
+        data["<color>"].add_listener(self._on_color_change)
+
+    @property
+    def image(self):
+        """the RGBA picture of the whole map, only allocated on the first use
+        (`export_bands` renders without it)"""
+        if self._image is None:
+            self._image = Image.new(mode="RGBA", size=self.size,
+                                    color=(255, 255, 255, 255))
+        return self._image
+
+    @property
+    def _draw(self):
+        if self._image_draw is None:
+            self._image_draw = ImageDraw.Draw(self.image, mode="RGBA")
+        return self._image_draw
 
     @overload
     def draw_single_hex_floor(self, node: gridcls.Node.Floor): ...
@@ -48,7 +340,7 @@ class MapCanvas:
         if len(args) == 1:
             if isinstance(args[0], gridcls.Node.Floor):
                 color_id = args[0].color
-                color = self.grid_data["<color>"].get_color(color_id)
+                color = self.grid_data["<color>"].get_rgba(color_id)
                 self.__draw_single_hex_floor(
                     pos=args[0].pos, color=color
                 )
@@ -60,7 +352,7 @@ class MapCanvas:
             node = kwargs["node"]
             if isinstance(node, gridcls.Node.Floor):
                 color_id = node.color
-                color = self.grid_data["<color>"].get_color(color_id)
+                color = self.grid_data["<color>"].get_rgba(color_id)
                 self.__draw_single_hex_floor(
                     pos=node.pos, color=color
                 )
@@ -76,33 +368,30 @@ class MapCanvas:
     def __draw_single_hex_floor(self, pos, color):
         if not self.map_created:
             self.craete_map()
-        points = pos.point_list_around()
-        color_t = ImageColor.getrgb(color)
-        self._draw.polygon(points, fill=color_t,
-                           outline=(0, 0, 0, 255), width=1)
-
-    def _draw_floors(self):
-        for i in self.grid_data["<floor>"].get_data_iter():
-            pos = i.pos
-            color_id = int(i.color)
-            color = self.grid_data["<color>"].get_color(color_id)
-            # print(pos, color)
-            self.__draw_single_hex_floor(pos=pos, color=color)
+        points = np.array([pos.point_list_around(self.radius)])
+        if isinstance(color, tuple):
+            color_t = color
+        else:
+            color_t = ImageColor.getrgb(color)
+        self._paste_floors(points, [color_t], self.image)
 
     def draw_single_grid(self, pos: gridcls.Pos):
         "draw the outlines of the hexagon and print the pos title"
-        self._draw.line(pos.point_list_around(),
+        self._draw.line(pos.point_list_around(self.radius),
                         fill=(0, 0, 0, 255), width=1)
         txt = pos.show_pos
-        t_p = pos.coord_text_cood()
+        t_p = pos.coord_text_cood(self.radius)
         self._draw.text(t_p, text=txt, fill=(
             0, 0, 0, 255), font=self._font_title, anchor="ma")
 
-    def _draw_map_grid(self):
-        for i in range(self.grid_data["<set>"].x_max + 1):
-            for j in range(1, self.grid_data["<set>"].y_max + 1):
-                x = gridcls.Pos(i, j)
-                self.draw_single_grid(pos=x)
+    def _draw_map_grid(self, image, box=None):
+        # the layer of the whole map is kept for the repaints
+        setting = self.grid_data["<set>"]
+        layer = GRID_LAYERS.get(setting.x_max, setting.y_max, self.radius,
+                                self._font_title)
+        if box is not None:
+            layer = layer.crop(box)
+        image.paste((0, 0, 0, 255), box=(0, 0), mask=layer)
 
     def draw_single_stamp(self, stamp_type, stamp_color_id, pos,
                           text=None, mask_alpha=None):
@@ -110,24 +399,12 @@ class MapCanvas:
         # TODO: use google icons
         if not self.map_created:
             self.craete_map()
-        stm = load_stamp(
-            stamp_type, stamp_color_id
-        ).resize(
-            (int((1.5 - global_const.PX_RATIO) * global_const.PX_R * 2),
-             int((1.5 - global_const.PX_RATIO) * global_const.PX_R * 2))
-        )
-        paste_bbox = pos.image_paste_box()
-        alpha = stm.getchannel("A")
-        if mask_alpha is None:
-            mask_alpha = 0x7d
-        mask_t = Image.new("L", alpha.size, color=mask_alpha)
-        mask = ImageChops.darker(alpha, mask_t)  # 整体透明度增加
-        self.image.paste(stm, box=paste_bbox, mask=mask)
-        mask.close()
-        stm.close()
-        if text is not None:
-            self._draw.text(pos.xy_abs, text=text[0], font=self._font_title,
-                            anchor="mm", fill=text[1])
+        self._paste_stamp(
+            stamp_type, stamp_color_id,
+            paste_bbox=pos.image_paste_box(self.radius),
+            text_xy=pos.xy_abs_r(self.radius),
+            target=(self.image, self._draw), text=text,
+            mask_alpha=mask_alpha)
 
     def draw_single_item(self, item):
         "draw the single item marker on the map from node obj"
@@ -139,17 +416,6 @@ class MapCanvas:
             stamp_type=stamp_type, stamp_color_id=stamp_color_id,
             pos=pos, text=(text, (0xff, 0xff, 0xff, 0xff)))
 
-    def _draw_items(self):
-        for item in self.grid_data["<item>"].get_data_iter():
-            self.draw_single_item(item)
-            # stamp_type = item.type
-            # stamp_color_id = item.color
-            # pos = item.pos
-            # text = f"i-{item.id}"
-            # self.draw_single_stamp(
-            #     stamp_type=stamp_type, stamp_color_id=stamp_color_id,
-            #     pos=pos, text=(text, (0xff, 0xff, 0xff, 0xff)))
-
     def draw_single_player(self, player):
         "draw the single player marker on the map from node obj"
         stamp_type = player.type
@@ -161,31 +427,101 @@ class MapCanvas:
             pos=pos, text=(text, (0xff, 0xff, 0xff, 0xff)),
             mask_alpha=0xff)
 
-    def _draw_players(self):
-        for item in self.grid_data["<player>"].get_data_iter():
-            self.draw_single_player(item)
+    def cell_box(self, pos, layer="floor"):
+        """the pixel box (left, upper, right, lower) of the hexagon of the
+        pos in the layer (the markers are wider, for their titles), inside
+        the canvas, None if it is out of the canvas"""
+        _x, _y = pos if isinstance(pos, tuple) else pos.pos_tuple
+        c_x, c_y = geometry.center(_x, _y, self.radius)
+        _w = self.radius + (self.radius if layer in ("item", "player")
+                            else 0)
+        _h = global_const.PX_RATIO * self.radius
+        width, height = self.size
+        box = (max(int(c_x - _w) - 1, 0), max(int(c_y - _h) - 1, 0),
+               min(int(c_x + _w) + 2, width), min(int(c_y + _h) + 2, height))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return None
+        return box
+
+    def _repaint_all(self):
+        return 2 * self._dirty_area > self.size[0] * self.size[1]
+
+    def mark_dirty(self, pos, layers=LAYERS):
+        "repaint the hexagon of the pos in the layers on the next `refresh`"
+        if self._repaint_all():
+            return
+        for layer in layers:
+            box = self.cell_box(pos, layer)
+            if box is not None and box not in self.dirty[layer]:
+                self.dirty[layer].add(box)
+                self._dirty_area += (box[2] - box[0]) * (box[3] - box[1])
+
+    def mark_all_dirty(self):
+        "repaint the whole map on the next `refresh`"
+        self._dirty_area = self.size[0] * self.size[1]
+
+    def _on_change(self, tag, pos, _row):
+        # the rows are only drawn by the next refresh
+        layer = self._TAG_LAYERS.get(tag)
+        if layer is not None and self.map_created:
+            self.mark_dirty(pos, (layer,))
+
+    def _on_color_change(self, _tag, _color_id, _row):
+        # any floor (or marker) of the map may be in the color
+        if self.map_created:
+            self.mark_all_dirty()
+
+    def _repaint(self, box):
+        "draw the layers again in the box"
+        image = self.paint(box)
+        self.image.paste(image, box=box[:2])
+        image.close()
+
+    def refresh(self):
+        """repaint the dirty boxes of the layers (the whole map on the first
+        call, or if they cover most of it), return the number of boxes"""
+        if not self.map_created:
+            self.craete_map()
+            return 1
+        if self._repaint_all():
+            self.craete_map()
+            return 1
+        # the lower layers show through, a box is painted again with all
+        boxes = set().union(*self.dirty.values())
+        for box in boxes:
+            self._repaint(box)
+        self._clear_dirty()
+        return len(boxes)
+
+    def _clear_dirty(self):
+        for dirty in self.dirty.values():
+            dirty.clear()
+        self._dirty_area = 0
 
     # @timeit.Timer
     def craete_map(self):
         "draw the map according to the data"
+        if self.map_created:
+            self.image.paste((255, 255, 255, 255),
+                             box=(0, 0) + self.image.size)
         self.map_created = True
-        self._draw_floors()
-        self._draw_map_grid()
-        self._draw_items()
-        self._draw_players()
+        if self.workers > 1:
+            for box, tile in render_tiles(self.grid_data,
+                                          workers=self.workers,
+                                          palette_stamps=self.palette_stamps):
+                self.image.paste(tile, box=box[:2])
+                tile.close()
+        else:
+            self._draw_floors(self.image)
+            self._draw_map_grid(self.image)
+            self._draw_items(self.image)
+            self._draw_players(self.image)
+        self._clear_dirty()
 
     def draw_from_pos_conf(self, pos_conf: gridcls.PosConf):
         "redraw a single hexagon grid"
-        if pos_conf.floor:
-            self.draw_single_hex_floor(node=pos_conf.floor)
-        else:   # draw a white hexagon to clear the grid
-            color = gridcls.Node.Color("#FFFFFF")
-            self.draw_single_hex_floor(pos=pos_conf.pos, color=color)
-        self.draw_single_grid(pos=pos_conf.pos)
-        if pos_conf.item:
-            self.draw_single_item(item=pos_conf.item)
-        if pos_conf.player:
-            self.draw_single_player(player=pos_conf.player)
+        self.mark_dirty(pos_conf.pos)
+        self.refresh()
 
     def output(self):
         "the resized version for output (save or preview)"
@@ -195,17 +531,446 @@ class MapCanvas:
         # im.resize((im.size[0]//2,im.size[1]//2),1)
         return img
 
-    def __del__(self):
-        self.image.close()
+    def close(self):
+        "stop following the edits of the map and free the picture"
+        self.grid_data.remove_listener(self._on_change)
+        self.grid_data["<color>"].remove_listener(self._on_color_change)
+        if self._image is not None:
+            self._image.close()
+
+
+def tile_boxes(size, tile_size=global_const.RENDER_TILE_PX):
+    "the pixel boxes of the tiles of a canvas of the size, row by row"
+    width, height = size
+    return [(left, upper, min(left + tile_size, width),
+             min(upper + tile_size, height))
+            for upper in range(0, height, tile_size)
+            for left in range(0, width, tile_size)]
+
+
+_WORKER_PAINTER = None  # the painter of a worker process of `render_tiles`
+
 
+def _init_painter(snapshot, palette_stamps):
+    global _WORKER_PAINTER  # pylint: disable=global-statement
+    _WORKER_PAINTER = MapPainter(snapshot, palette_stamps)
 
-def load_stamp(stamp_type, stamp_color_id):
-    "[WAITING FOR REFORM] load the stamp according to configures"
-    path = global_const.RESOURCE_STAMP_PATH.format(
-        type=global_const.RESOURCE_STAMP_TYPE[stamp_type],
-        color=int(stamp_color_id)
-    )
-    if isfile(path):
-        stm = Image.open(path)
-        return stm
+
+def _paint_tile(box):
+    return _WORKER_PAINTER.paint(box)
+
+
+def render_tiles(data, tile_size=global_const.RENDER_TILE_PX, workers=None,
+                 palette_stamps=False, boxes=None):
+    """yield (box, RGBA picture) of the tiles of the whole map row by row,
+    painted in `workers` processes (the cpu count by default) from a
+    `GridSnapshot`, the same pixels as `MapCanvas.craete_map`
+    `data`: a `Grid` or a `GridSnapshot` of it
+    `boxes`: paint these pixel boxes instead of the tiles, in order"""
+    if not isinstance(data, GridSnapshot):
+        data = GridSnapshot(data, palette_stamps)
+    if boxes is None:
+        boxes = tile_boxes(data.size, tile_size)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        painter = MapPainter(data, palette_stamps)
+        for box in boxes:
+            yield (box, painter.paint(box))
+        return
+    with ProcessPoolExecutor(workers, initializer=_init_painter,
+                             initargs=(data, palette_stamps)) as pool:
+        # a few tiles in flight per worker, the others are not painted yet
+        pending = deque()
+        for box in boxes:
+            pending.append((box, pool.submit(_paint_tile, box)))
+            if len(pending) >= 2 * workers:
+                box, future = pending.popleft()
+                yield (box, future.result())
+        while pending:
+            box, future = pending.popleft()
+            yield (box, future.result())
+
+
+def export_bands(data, path, *, half=True,
+                 band_height=global_const.EXPORT_BAND_PX, workers=1,
+                 palette_stamps=False):
+    """render the map picture into `path` band by band, without the picture
+    of the whole map: a png is written while the bands are painted, the
+    other formats are saved from the RGB output picture
+    `half`: half size, each band is resized exactly 2:1 (an odd last row
+        or column of the map is left out), the same pixels as
+        `MapCanvas.output` when the map size is even
+    `band_height`: the rows of the map painted at once
+    `workers`: see `render_tiles`"""
+    data = GridSnapshot(data, palette_stamps)
+    width, height = data.size
+    scale = 2 if half else 1
+    size = (width // scale, height // scale)
+    # the lanczos filter of the resize reads 3 output rows around
+    margin = 4 * scale if half else 0
+    step = max(band_height // scale, 1)
+    rows = [(start, min(start + step, size[1]))
+            for start in range(0, size[1], step)]
+    boxes = [(0, max(start * scale - margin, 0), width,
+              min(stop * scale + margin, height)) for start, stop in rows]
+    bands = render_tiles(data, workers=workers, palette_stamps=palette_stamps,
+                         boxes=boxes)
+
+    def output_bands():
+        for (start, stop), (box, band) in zip(rows, bands):
+            if half:
+                out = band.resize((size[0], stop - start), 1, box=(
+                    0, start * scale - box[1], size[0] * scale,
+                    stop * scale - box[1]))
+            else:
+                out = band
+            yield out.convert("RGB")
+            band.close()
+
+    if os.path.splitext(path)[1].lower() == ".png":
+        with misc.replace_file(path, "wb") as file:
+            with pngstream.PngWriter(file, size) as writer:
+                for out in output_bands():
+                    writer.write(out)
+        return
+    # jpeg and the others are not written by rows, only the output is whole
+    image = Image.new("RGB", size)
+    top = 0
+    for out in output_bands():
+        image.paste(out, box=(0, top))
+        top += out.size[1]
+    image.save(path)
+    image.close()
+
+
+def make_grid_layer(x_max, y_max, radius, font, box=None):
+    """the "L" coverage of the outlines and the coordinate titles of all the
+    hexagons, the grid is pasted in black through it
+    `box`: only this pixel box of the layer"""
+    xs, ys = geometry.grid_cells(x_max, y_max)
+    if box is None:
+        origin = (0, 0)
+        layer = Image.new("L", geometry.canvas_size(x_max, y_max, radius),
+                          color=0)
+    else:
+        x_start, x_stop, y_start, y_stop = cell_range(box, radius)
+        keep = (xs >= x_start) & (xs < x_stop) & (ys >= y_start) \
+            & (ys < y_stop)
+        xs, ys = xs[keep], ys[keep]
+        # only the hexagons whose outline or title (no glyph is wider than
+        # the font size) may reach into the box
+        cen = geometry.centers(xs, ys, radius)
+        _w = np.maximum(radius, font.size / 2 * np.array(
+            [len(gridcls.pos_label(_x, _y))
+             for _x, _y in zip(xs.tolist(), ys.tolist())], dtype=np.int64))
+        _h = global_const.PX_RATIO * radius
+        _h = np.maximum(_h, 2 * font.size - _h)
+        keep = (cen[:, 0] - _w - 2 < box[2]) & (cen[:, 0] + _w + 2 > box[0]) \
+            & (cen[:, 1] - _h - 2 < box[3]) & (cen[:, 1] + _h + 2 > box[1])
+        xs, ys = xs[keep], ys[keep]
+        # the lines are cut to whole pixels towards 0, the hexagons around
+        # the box are drawn on the same side of it as on the whole layer
+        margin = 6 * int(radius)
+        origin = (max(box[0] - margin, 0), max(box[1] - margin, 0))
+        layer = Image.new("L", (box[2] - origin[0], box[3] - origin[1]),
+                          color=0)
+    draw = ImageDraw.Draw(layer)
+    # the 7 (x, y) of each outline in a row
+    lines = (geometry.polygons(xs, ys, radius) - origin).reshape(len(xs), 14)
+    anchors = geometry.label_anchors(xs, ys, radius) - origin
+    for _x, _y, line, anchor in zip(xs.tolist(), ys.tolist(),
+                                    lines.tolist(), anchors.tolist()):
+        draw.line(line, fill=255, width=1)
+        draw.text(tuple(anchor), text=gridcls.pos_label(_x, _y), fill=255,
+                  font=font, anchor="ma")
+    if box is None:
+        return layer
+    return layer.crop((box[0] - origin[0], box[1] - origin[1],
+                       box[2] - origin[0], box[3] - origin[1]))
+
+
+class GridLayerCache:
+    """the grid layers (see `make_grid_layer`) by (x_max, y_max, radius,
+    font), the least recently used ones are dropped
+    `cache_dir`: the layers are also kept there as png files, and read back
+        by the next processes"""
+
+    def __init__(self, capacity=2, cache_dir=None):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self._layers = OrderedDict()    # key: layer
+
+    def _path(self, key):
+        x_max, y_max, radius, font_path, font_size = key
+        font_name = os.path.splitext(os.path.basename(font_path))[0]
+        return os.path.join(
+            self.cache_dir,
+            f"grid_{x_max}x{y_max}_r{radius}_{font_name}_{font_size}.png")
+
+    def _read(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        with Image.open(path) as image:
+            if image.mode != "L" or image.size != geometry.canvas_size(
+                    *key[:3]):
+                return None
+            image.load()
+            return image.copy()
+
+    def get(self, x_max, y_max, radius, font):
+        "the grid layer, drawn (or read from `cache_dir`) on the first use"
+        key = (int(x_max), int(y_max), int(radius), str(font.path),
+               int(font.size))
+        layer = self._layers.get(key)
+        if layer is not None:
+            self._layers.move_to_end(key)
+            return layer
+        if self.cache_dir is not None:
+            layer = self._read(key)
+        if layer is None:
+            layer = make_grid_layer(*key[:3], font)
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with misc.replace_file(self._path(key), "wb") as file:
+                    layer.save(file, format="PNG")
+        self._layers[key] = layer
+        if len(self._layers) > self.capacity:
+            self._layers.popitem(last=False)
+        return layer
+
+    def clear(self):
+        "drop the layers in memory (the files in `cache_dir` are kept)"
+        self._layers.clear()
+
+    def __len__(self):
+        return len(self._layers)
+
+
+GRID_LAYERS = GridLayerCache()  # the cache of the process
+
+
+def make_hex_tile(points, color):
+    """the (tile, mask) of the hexagon of the points (7, 2): the tile is
+    filled with the color and outlined in black, the "1" mask holds the
+    pixels `ImageDraw.polygon` fills or outlines (width 1)"""
+    size = tuple(int(value) + 2 for value in np.max(points, axis=0))
+    points = [tuple(point) for point in points.tolist()]
+    tile = Image.new("RGBA", size, color=color)
+    ImageDraw.Draw(tile).polygon(points, outline=(0, 0, 0, 255), width=1)
+    mask = Image.new("1", size, color=0)
+    draw = ImageDraw.Draw(mask)
+    draw.polygon(points, fill=1)
+    # not in the same call, an outline of the fill color is skipped
+    draw.polygon(points, outline=1, width=1)
+    return (tile, mask)
+
+
+class HexTileCache:
+    """the pre-rendered floor hexagons, by color and position of the hexagon
+    inside a pixel (the pixels a polygon covers depend on it, the rows of
+    the map repeat a few of them), the least recently used ones are
+    dropped"""
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self._tiles = OrderedDict()     # (phase, color): (tile, mask)
+
+    @staticmethod
+    def phases(points):
+        """(left-top int array (n, 2), phase ids (n,), [local points (7, 2)
+        of each phase]) of the hexagons of the points (n, 7, 2)"""
+        origins = np.floor(points.min(axis=1)).astype(np.int64) - 1
+        local = points - origins[:, None, :]
+        keys, first, phases = np.unique(
+            np.round(local.reshape(len(points), -1), 6), axis=0,
+            return_index=True, return_inverse=True)
+        return (origins, phases.reshape(-1),
+                [(tuple(key), local[index])
+                 for key, index in zip(keys.tolist(), first.tolist())])
+
+    def get(self, phase, color):
+        """the (tile, mask) of the hexagon in the color
+        `phase`: (key, local points) from `phases`"""
+        key = (phase[0], tuple(color))
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+        tile = self._tiles[key] = make_hex_tile(phase[1], key[1])
+        if len(self._tiles) > self.capacity:
+            self._tiles.popitem(last=False)
+        return tile
+
+    def clear(self):
+        "drop all the tiles"
+        self._tiles.clear()
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+HEX_TILES = HexTileCache()  # the cache of the process
+
+
+def shipped_color_id(color):
+    """the stamp color id of the shipped stamps drawn in the color, None if
+    no stamp is shipped in it
+    `color`: see `stamp_tones`"""
+    if isinstance(color, str):
+        color = ImageColor.getrgb(color)
+    elif not isinstance(color, tuple):
+        return int(color)
+    rgb = tuple(int(value) for value in color[:3])
+    for color_id, (body, _outline) in enumerate(global_const.STAMP_COLORS):
+        if ImageColor.getrgb(body)[:3] == rgb:
+            return color_id
     return None
+
+
+def stamp_tones(color):
+    """the (body, outline) rgb of a stamp color: an id of the built-in stamp
+    colors, a "#rgb" string or an (r, g, b[, a]) tuple"""
+    if isinstance(color, str):
+        body = ImageColor.getrgb(color)[:3]
+    elif isinstance(color, tuple):
+        body = tuple(int(value) for value in color[:3])
+    else:
+        body, outline = global_const.STAMP_COLORS[int(color)]
+        return (ImageColor.getrgb(body)[:3], ImageColor.getrgb(outline)[:3])
+    outline = tuple(round(value * global_const.STAMP_OUTLINE_SHADE)
+                    for value in body)
+    return (body, outline)
+
+
+class StampAtlas:
+    """the shipped stamps and the masks of all the stamp types, decoded once
+    from the atlas image, the colors with no shipped stamp are tinted from
+    the masks (resized once per size)"""
+
+    def __init__(self, path=global_const.RESOURCE_STAMP_ATLAS,
+                 boxes=None, row_px=global_const.RESOURCE_STAMP_ROW_PX):
+        self.path = path
+        self.boxes = boxes or global_const.RESOURCE_STAMP_BOX
+        self.row_px = row_px
+        self._atlas = None
+        self._masks = {}    # (type, size): "LA" mask
+
+    def _crop(self, stamp_type, row):
+        if self._atlas is None:
+            with Image.open(self.path) as image:
+                image.load()
+                self._atlas = image.convert("RGBA")
+        left, upper, right, lower = self.boxes[int(stamp_type)]
+        upper, lower = upper + row * self.row_px, lower + row * self.row_px
+        return self._atlas.crop((left, upper, right, lower))
+
+    def stamp(self, stamp_type, color_id):
+        "the shipped RGBA stamp of the stamp color id, at its own size"
+        return self._crop(stamp_type, int(color_id))
+
+    def mask(self, stamp_type, size):
+        "the mask of the stamp type resized to `size` px (L: shade, A: alpha)"
+        key = (int(stamp_type), int(size))
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._crop(key[0], len(global_const.STAMP_COLORS))
+            mask = Image.merge("LA", (mask.getchannel("R"),
+                                      mask.getchannel("A")))
+            mask = self._masks[key] = mask.resize((key[1], key[1]))
+        return mask
+
+    def tint(self, stamp_type, color, size):
+        "the RGBA stamp in the color (see `stamp_tones`)"
+        shade, alpha = self.mask(stamp_type, size).split()
+        bands = [
+            shade.point([round(low + (high - low) * value / 255)
+                         for value in range(256)])
+            for high, low in zip(*stamp_tones(color))
+        ]
+        return Image.merge("RGBA", bands + [alpha])
+
+    def get(self, stamp_type, color, size):
+        """the RGBA stamp in the color resized to `size` px: the shipped
+        stamp if there is one in the color, or else tinted"""
+        color_id = shipped_color_id(color)
+        if color_id is None:
+            return self.tint(stamp_type, color, size)
+        return self.stamp(stamp_type, color_id).resize((size, size))
+
+    def clear(self):
+        "drop the decoded atlas and the resized masks"
+        self._atlas = None
+        self._masks.clear()
+
+
+ATLAS = StampAtlas()    # the atlas of the process
+
+
+def make_sprite(stamp_type, color, size, mask_alpha=0x7d):
+    "the (image, mask) of the stamp ready to paste"
+    stm = ATLAS.get(stamp_type, color, size)
+    alpha = stm.getchannel("A")
+    mask_t = Image.new("L", alpha.size, color=mask_alpha)
+    mask = ImageChops.darker(alpha, mask_t)  # 整体透明度增加
+    return (stm, mask)
+
+
+class SpriteCache:
+    """the stamps ready to paste, shared by all the canvases, by (type,
+    color, size, mask alpha), the least recently used ones are dropped"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._sprites = OrderedDict()   # key: (image, mask)
+
+    def get(self, stamp_type, color, size, mask_alpha=0x7d):
+        """the (image, mask) of the stamp, made on the first use
+        `color`: see `stamp_tones`"""
+        color_id = shipped_color_id(color)
+        if color_id is not None:
+            color = color_id
+        elif isinstance(color, tuple):
+            color = tuple(int(value) for value in color[:3])
+        key = (int(stamp_type), color, int(size), int(mask_alpha))
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self.hits += 1
+            self._sprites.move_to_end(key)
+            return sprite
+        self.misses += 1
+        sprite = make_sprite(*key)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.capacity:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def warm_up(self, size, stamp_types=None, colors=None,
+                mask_alphas=(0x7d, 0xff)):
+        """make the sprites before rendering (all the stamp types and the
+        built-in stamp colors by default), return the number of sprites
+        made"""
+        if stamp_types is None:
+            stamp_types = range(len(global_const.RESOURCE_STAMP_TYPE))
+        if colors is None:
+            colors = range(len(global_const.STAMP_COLORS))
+        misses = self.misses
+        for stamp_type in stamp_types:
+            for color in colors:
+                for mask_alpha in mask_alphas:
+                    self.get(stamp_type, color, size, mask_alpha)
+        return self.misses - misses
+
+    def clear(self):
+        "drop all the sprites and reset the counters"
+        self._sprites.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._sprites)
+
+
+SPRITES = SpriteCache()     # the cache of the process
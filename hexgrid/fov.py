@@ -0,0 +1,241 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# line of sight and field of view on the map
+# the field of view is computed by shadowcasting ring by ring: the cell i of
+# the ring k (6k cells) covers the angle [(i - 0.5) / 6k, (i + 0.5) / 6k) of a
+# full turn, a cell is visible if the center of its angle is not in the
+# shadow of the opaque cells seen before it
+
+import numpy as np
+
+from . import gridcls, hexcoord, mapcache
+
+
+class Opacity:
+    """what blocks the view
+    `colors`: floor color ids that are opaque
+    `item_types`: item types (stamp ids) that are opaque"""
+
+    def __init__(self, colors=(), item_types=()):
+        self.colors = frozenset(int(_c) for _c in colors)
+        self.item_types = frozenset(int(_t) for _t in item_types)
+
+
+class VisibilityMask:
+    "the visible cells as a bitmask (bit `cell_index` of the cell)"
+
+    def __init__(self, bits: int, x_max: int, y_max: int):
+        self.bits = bits
+        self.x_max = x_max
+        self.y_max = y_max
+
+    @classmethod
+    def from_cells(cls, cells, x_max, y_max):
+        "build the mask from flat cell indexes"
+        flags = np.zeros((x_max + 1) * (y_max + 1), dtype=bool)
+        flags[np.asarray(cells, dtype=np.int64)] = True
+        return cls(int.from_bytes(
+            np.packbits(flags, bitorder="little").tobytes(), "little"),
+            x_max, y_max)
+
+    @property
+    def nbytes(self):
+        "bytes of the bits of the mask"
+        return (self.bits.bit_length() + 7) // 8
+
+    def __contains__(self, pos):
+        if isinstance(pos, gridcls.Pos):
+            pos = pos.pos_tuple
+        if not (0 <= pos[0] <= self.x_max and 1 <= pos[1] <= self.y_max):
+            return False
+        return bool(self.bits >> (pos[0] * (self.y_max + 1) + pos[1]) & 1)
+
+    def __or__(self, other):
+        return VisibilityMask(self.bits | other.bits, self.x_max, self.y_max)
+
+    def __and__(self, other):
+        return VisibilityMask(self.bits & other.bits, self.x_max, self.y_max)
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def cells(self):
+        "flat cell indexes of the visible cells"
+        n_cells = (self.x_max + 1) * (self.y_max + 1)
+        raw = np.frombuffer(
+            self.bits.to_bytes((n_cells + 7) // 8, "little"), dtype=np.uint8)
+        return np.nonzero(
+            np.unpackbits(raw, bitorder="little")[:n_cells])[0]
+
+    def positions(self):
+        "the visible cells as Pos"
+        xs, ys = hexcoord.cell_xy(self.cells(), self.y_max)
+        return [gridcls.Pos(_x, _y) for _x, _y in zip(xs.tolist(),
+                                                     ys.tolist())]
+
+
+def _in_shadow(shadows, angle):
+    "the shadows may go below 0 or over 1, the angle is tested modulo 1"
+    for start, end in shadows:
+        if start < angle < end or start < angle - 1 < end \
+                or start < angle + 1 < end:
+            return True
+    return False
+
+
+def _add_shadow(shadows, start, end):
+    "add (start, end) and keep the list merged"
+    merged = []
+    for old_start, old_end in shadows:
+        if old_end < start or old_start > end:
+            merged.append((old_start, old_end))
+        else:
+            start = min(start, old_start)
+            end = max(end, old_end)
+    merged.append((start, end))
+    merged.sort()
+    shadows[:] = merged
+
+
+class FieldOfView(mapcache.MapCache):
+    """line of sight and memoized fields of view over a `gridcls.Grid`,
+    kept up to date by listening to the <floor> and <item> sections
+    `budget`: bytes of the memoized fields (see `mapcache.MapCache`), keyed
+        by (origin cell, radius, version)"""
+
+    def __init__(self, grid: gridcls.Grid, opacity: Opacity = None,
+                 budget=64 << 20):
+        self.x_max = grid["<set>"].x_max
+        self.y_max = grid["<set>"].y_max
+        self.opacity = opacity if opacity is not None else Opacity()
+        self.version = 0    # bumped when the opacity rules change
+        super().__init__(grid, budget)
+        self._build()
+
+    def set_opacity(self, opacity: Opacity):
+        "change what blocks the view, all the memoized fields are dropped"
+        self.opacity = opacity
+        self.version += 1
+        self._cache.clear()
+        self._build()
+
+    def _inside(self, _x, _y):
+        return 0 <= _x <= self.x_max and 1 <= _y <= self.y_max
+
+    def _build(self):
+        self.opaque = np.zeros(
+            (self.x_max + 1) * (self.y_max + 1), dtype=bool)
+        floors = self.grid["<floor>"].get_columns().array
+        items = self.grid["<item>"].get_columns().array
+        for array, key, values in ((floors, "color", self.opacity.colors),
+                                   (items, "type", self.opacity.item_types)):
+            if not values or array.size == 0:
+                continue
+            hit = np.isin(array[key], list(values))
+            hit &= hexcoord.in_map(array["x"], array["y"],
+                                   self.x_max, self.y_max)
+            self.opaque[hexcoord.cell_index(
+                array["x"][hit], array["y"][hit], self.y_max)] = True
+
+    def _cell_opaque(self, pos):
+        floor = self.grid["<floor>"].get_on_pos(pos)
+        if floor is not None and int(floor.color) in self.opacity.colors:
+            return True
+        item = self.grid["<item>"].get_on_pos(pos)
+        return item is not None and int(item.type) in self.opacity.item_types
+
+    def _on_map_change(self, _tag, pos, _row):
+        if isinstance(pos, gridcls.Pos):
+            pos = pos.pos_tuple
+        if not self._inside(*pos):
+            return
+        cell = pos[0] * (self.y_max + 1) + pos[1]
+        opaque = self._cell_opaque(pos)
+        if opaque == self.opaque[cell]:
+            return
+        self.opaque[cell] = opaque
+        # only the fields that can reach the cell change
+        for key in list(self._cache):
+            origin, radius, _ = key
+            o_x, o_y = divmod(origin, self.y_max + 1)
+            if hexcoord.distance(o_x, o_y, pos[0], pos[1]) <= radius:
+                del self._cache[key]
+
+    def is_opaque(self, pos):
+        "the pos blocks the view"
+        if isinstance(pos, gridcls.Pos):
+            pos = pos.pos_tuple
+        if not self._inside(*pos):
+            return False
+        return bool(self.opaque[pos[0] * (self.y_max + 1) + pos[1]])
+
+    def line_of_sight(self, start, end):
+        "no opaque hexagon between start and end (both excluded)"
+        if isinstance(start, gridcls.Pos):
+            start = start.pos_tuple
+        if isinstance(end, gridcls.Pos):
+            end = end.pos_tuple
+        cells = hexcoord.line(start[0], start[1], end[0], end[1])
+        return not any(self.is_opaque(cell) for cell in cells[1:-1])
+
+    def _shadowcast(self, o_x, o_y, radius):
+        y_size = self.y_max + 1
+        opaque = self.opaque
+        visible = [o_x * y_size + o_y]
+        shadows = []
+        for k in range(1, radius + 1):
+            if any(end - start >= 1 for start, end in shadows):
+                break
+            n_cells = 6 * k
+            new_shadows = []
+            for i, (_x, _y) in enumerate(hexcoord.ring(o_x, o_y, k)):
+                if _in_shadow(shadows, i / n_cells):
+                    continue
+                inside = self._inside(_x, _y)
+                if inside:
+                    visible.append(_x * y_size + _y)
+                if inside and opaque[_x * y_size + _y]:
+                    new_shadows.append(((i - 0.5) / n_cells,
+                                        (i + 0.5) / n_cells))
+            # cells of the same ring do not shadow each other
+            for start, end in new_shadows:
+                _add_shadow(shadows, start, end)
+        return visible
+
+    def visible(self, origin, radius: int):
+        "the `VisibilityMask` of the hexagons seen from the origin"
+        if isinstance(origin, gridcls.Pos):
+            origin = origin.pos_tuple
+        if not self._inside(*origin):
+            raise ValueError(f"pos {origin} is outside the map")
+        key = (origin[0] * (self.y_max + 1) + origin[1], radius, self.version)
+        mask = self._cached(key)
+        if mask is None:
+            mask = self._store(key, VisibilityMask.from_cells(
+                self._shadowcast(origin[0], origin[1], radius),
+                self.x_max, self.y_max))
+        return mask
+
+    def visible_for_players(self, radius: int):
+        "{player id: VisibilityMask} of all the players on the map"
+        ret = {}
+        for player in self.grid["<player>"].get_data_iter():
+            if self._inside(*player.pos.pos_tuple):
+                ret[player.id] = self.visible(player.pos, radius)
+        return ret
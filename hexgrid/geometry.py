@@ -0,0 +1,104 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# pixel geometry of the hexagons, for arrays of (_x, _y) at once
+# the odd columns are shifted half a hexagon up, the same as `gridcls.Pos`
+# NOTE: keep the order of the float operations, the results must be the same
+# as the scalar ones so that the rendered pictures do not change
+
+import numpy as np
+
+from . import global_const
+
+
+def _as_xy(xs, ys):
+    return (np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64))
+
+
+def center(_x, _y, radius=global_const.PX_R):
+    "absolute coordinate of a single hexagon center on the canvas"
+    c_x = _x * radius * 1.5
+    c_y = ((_x // 2 - _x / 2)
+           * radius * 2
+           * global_const.PX_RATIO + 2 * _y
+           * radius * global_const.PX_RATIO)
+    return (c_x, c_y)
+
+
+def centers(xs, ys, radius=global_const.PX_R):
+    "hexagon centers, float array of shape (n, 2)"
+    xs, ys = _as_xy(xs, ys)
+    ret = np.empty((len(xs), 2), dtype=np.float64)
+    ret[:, 0], ret[:, 1] = center(xs, ys, radius)
+    return ret
+
+
+def polygons(xs, ys, radius=global_const.PX_R):
+    """the 7 points (closed) of the grid lines around the hexagons,
+    float array of shape (n, 7, 2)"""
+    cen = centers(xs, ys, radius)
+    _h = global_const.PX_RATIO * radius
+    offset = np.array([
+        (-radius, 0),
+        (-radius / 2, _h),
+        (radius / 2, _h),
+        (radius, 0),
+        (radius / 2, -_h),
+        (-radius / 2, -_h),
+        (-radius, 0),
+    ], dtype=np.float64)
+    return cen[:, None, :] + offset[None, :, :]
+
+
+def label_anchors(xs, ys, radius=global_const.PX_R):
+    "where the coordinate titles are printed, float array of shape (n, 2)"
+    ret = centers(xs, ys, radius)
+    ret[:, 1] -= global_const.PX_RATIO * radius
+    return ret
+
+
+def stamp_offset(radius=global_const.PX_R):
+    "distance from the hexagon center to the left-top of the stamp"
+    return int((1.5 - global_const.PX_RATIO) * radius)
+
+
+def stamp_size(radius=global_const.PX_R):
+    "width (and height) of the stamps pasted on the hexagons"
+    return int((1.5 - global_const.PX_RATIO) * radius * 2)
+
+
+def paste_boxes(xs, ys, radius=global_const.PX_R):
+    "left-top of the stamps on the hexagons, int array of shape (n, 2)"
+    # int() of the scalar version truncates to zero, so does astype
+    return (centers(xs, ys, radius).astype(np.int64)
+            - stamp_offset(radius))
+
+
+def canvas_size(x_max, y_max, radius=global_const.PX_R):
+    "the size of the whole map picture"
+    _x = radius * 1.5 * (x_max + 0.7)
+    _y = (radius * global_const.PX_RATIO
+          * (y_max + 0.5) * 2)
+    return (int(_x), int(_y))
+
+
+def grid_cells(x_max, y_max):
+    "(xs, ys) of all hexagons drawn on the map, column by column"
+    xs, ys = np.meshgrid(np.arange(x_max + 1), np.arange(1, y_max + 1),
+                         indexing="ij")
+    return (xs.ravel(), ys.ravel())
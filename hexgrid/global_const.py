@@ -20,13 +20,35 @@
 # the global default config of single hexagon
 PX_RATIO = 0.866    # sqrt(3)/2     y/x
 PX_R = 60           # hexagon radius
+RENDER_TILE_PX = 1024   # the side of the tiles painted by the worker processes
+EXPORT_BAND_PX = 256    # the rows of the map painted at once by an export
 
-# the sesource stamp file path
-RESOURCE_STAMP_PATH = "./res/stamp/{type}_{color:d}.png"
+# the resource stamp atlas: the shipped stamps unchanged, one row per stamp
+# color id, then a row of grayscale masks to tint the other colors with
+# (R = G = B: 255 on the body, 0 on the outline, A: the alpha of the stamp)
+RESOURCE_STAMP_ATLAS = "./res/stamp/atlas.png"
 RESOURCE_STAMP_TYPE = [
     "add", "circle", "crosscircle", "heart", "multiply",
     "square", "star", "triangle"
 ]
+# (left, upper, right, lower) of the stamps in the first row of the atlas,
+# by stamp type
+RESOURCE_STAMP_BOX = [
+    (0, 0, 43, 46), (43, 0, 94, 51), (94, 0, 152, 58), (152, 0, 210, 57),
+    (210, 0, 252, 46), (252, 0, 311, 59), (311, 0, 373, 62),
+    (373, 0, 432, 67)
+]
+RESOURCE_STAMP_ROW_PX = 67  # the rows of the atlas are this far apart
+# the colors (body, outline) of the shipped stamps, by stamp color id
+STAMP_COLORS = [
+    ("#FEFEFE", "#000000"), ("#000000", "#000000"),
+    ("#5F95E5", "#446DA9"), ("#58B6E5", "#3E85A8"),
+    ("#55CA95", "#3D946C"), ("#FEBA55", "#BC883C"),
+    ("#F08770", "#B16250"), ("#EC5F73", "#AD4453")
+]
+# a stamp in a color with no shipped stamp is tinted from the mask, its
+# outline is the body color shaded by this
+STAMP_OUTLINE_SHADE = 0.73
 
 # the font in the map
 FONT_TITLE_SIZE = 24
@@ -34,6 +56,9 @@ FONT_TITLE_PATH = r"./res/font/Ubuntu-B.ttf"
 FONT_DESC_PATH = r"./res/font/Ubuntu-L.ttf"
 
 SAVE_FILE_HEADER = "GRIDMAP 0.1\n"
+# the binary save file starts with these bytes (see binsave.py)
+BINARY_SAVE_HEADER = b"GRIDMAPB"
+BINARY_SAVE_VERSION = (0, 1)
 # the unix terminal word color
 
 # NEW MAP WITH A SET OF BASIC COLORS
@@ -16,17 +16,99 @@
    limitations under the License.
 """
 
+import csv
+import os
 import re
 from dataclasses import dataclass
-from math import log
+from functools import lru_cache
 from typing import Any, overload
 
+import numpy as np
+
 # import hexgrid
-from . import global_const, misc
+from . import binsave, geometry, global_const, hexcoord, misc
+
+
+_LABEL_CACHE_SIZE = 1 << 13
+_LABEL_RE = re.compile(r"([A-Z]+)(\d+)")
+_DIGITS = "0123456789"
+_label_cache = {}   # label: (_x, _y), cleared when it is full
+_set_slot = object.__setattr__
+
+
+@lru_cache(maxsize=_LABEL_CACHE_SIZE)
+def _letters_to_x(letters: str):
+    "'A' -> 1, 'Z' -> 26, 'AA' -> 27 (cached, a map has few columns)"
+    x_val = 0
+    for char in letters.upper().encode(encoding="utf-8"):
+        x_val = x_val * 26 + char - 0x40
+    return x_val
+
+
+def label_to_xy(pos: str):
+    "parse the label like 'AB12' to (_x, _y) (cached)"
+    ret = _label_cache.get(pos)
+    if ret is not None:
+        return ret
+    letters = pos.rstrip(_DIGITS)
+    if letters.isalpha() and letters.isascii() and len(letters) < len(pos):
+        ret = (_letters_to_x(letters), int(pos[len(letters):]))
+    else:
+        _r = _LABEL_RE.match(pos.upper())
+        if _r is None:
+            raise ValueError(pos)
+        x_str, y_str = _r.groups()
+        ret = (_letters_to_x(x_str), int(y_str))
+    if len(_label_cache) >= _LABEL_CACHE_SIZE:
+        _label_cache.clear()
+    _label_cache[pos] = ret
+    return ret
+
+
+def labels_to_xy(labels):
+    "parse a batch of labels at once, return ([_x], [_y])"
+    labels = list(labels)
+    prefixes = [label.rstrip(_DIGITS) for label in labels]
+    x_of = {}
+    for prefix in set(prefixes):
+        if not (prefix.isalpha() and prefix.isascii()):
+            break
+        x_of[prefix] = _letters_to_x(prefix)
+    else:
+        try:
+            ys = list(map(int, [label[len(prefix):] for label, prefix
+                                in zip(labels, prefixes)]))
+            return (list(map(x_of.__getitem__, prefixes)), ys)
+        except ValueError:  # no row number
+            pass
+    # unusual labels, parse them one by one
+    pairs = [label_to_xy(label) for label in labels]
+    return ([pair[0] for pair in pairs], [pair[1] for pair in pairs])
+
+
+@lru_cache(maxsize=_LABEL_CACHE_SIZE)
+def _x_to_label(_x: int):
+    "the text version of _x coordinate, 1 -> A, 26 -> Z, 27 -> AA (cached)"
+    x_lst = []
+    while _x > 0:
+        _x, this = divmod(_x - 1, 26)
+        x_lst.append(this + 0x41)
+    x_lst.reverse()
+    return bytes(x_lst).decode(encoding="utf-8")
+
+
+def pos_label(_x: int, _y: int) -> str:
+    "the output version of pos on the grid, like 'AB12' ('' if _x <= 0)"
+    if _x <= 0:
+        return ""
+    return f"{_x_to_label(_x)}{_y}"
 
 
 class Pos:
-    "Position class used for hexgrid locate"
+    "Position class used for hexgrid locate (immutable)"
+    __slots__ = ("point_x", "point_y")
+    point_x: int
+    point_y: int
 
     @overload
     def __init__(self, _x: int, _y: int): ...
@@ -48,37 +130,29 @@ class Pos:
             raise ValueError(args, kwargs)
 
     def _init_xy(self, _x: int, _y: int):
-        x_val = int(_x)
-        y_val = int(_y)
-        self.point_x = x_val
-        self.point_y = y_val
+        _set_slot(self, "point_x", int(_x))
+        _set_slot(self, "point_y", int(_y))
 
     def _init_pos(self, pos: str):
-        pos = pos.upper()
-        _r = re.match(r"([A-Z]+)(\d+)", pos)
-        if _r is None:
-            raise ValueError(pos)
-        x_str, y_str = _r.groups()
-        x_tmp = [int(_x - 0x40) for _x in x_str.encode(encoding="utf-8")]
-        x_tmp.reverse()
-        x_val = 0
-        for i, j in enumerate(x_tmp):    # range(len(x_tmp)):
-            x_val += j * (26 ** i)
-        # x_val = int(x_str.encode(encoding="utf-8")[0]) - 0x40
-        y_val = int(y_str)
-        self.point_x = x_val
-        self.point_y = y_val
+        x_val, y_val = label_to_xy(pos)
+        _set_slot(self, "point_x", x_val)
+        _set_slot(self, "point_y", y_val)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Pos is immutable, cannot set '{name}'")
+
+    def __reduce__(self):
+        return (Pos, (self.point_x, self.point_y))
 
     # def goto(self, vector=(0, 0)):
     #     _x = self.point_x + vector[0]
     #     _y = self.point_y + vector[1]
     #     return Pos(_x, _y)
 
-    def point_list_around(self):
+    def point_list_around(self, radius=global_const.PX_R):
         "return the 6 points of the grid lines around the pos"
-        _t = []
-        _x, _y = self.xy_abs
-        _r = global_const.PX_R
+        _x, _y = self.xy_abs_r(radius)
+        _r = radius
         _h = global_const.PX_RATIO * _r
         _t = [
             (_x - _r, _y),
@@ -91,44 +165,72 @@ class Pos:
         ]
         return _t
 
-    def coord_text_cood(self):
+    def coord_text_cood(self, radius=global_const.PX_R):
         "cood for grid title"
-        _x, _y = self.xy_abs
+        _x, _y = self.xy_abs_r(radius)
         t_x = _x
-        t_y = _y - global_const.PX_RATIO * global_const.PX_R
+        t_y = _y - global_const.PX_RATIO * radius
         return (t_x, t_y)
 
-    def image_paste_box(self):
+    def image_paste_box(self, radius=global_const.PX_R):
         "the cood where image should paste (left-top)"
-        _x, _y = map(int, self.xy_abs)
-        _d = int(
-            (1.5 - global_const.PX_RATIO)
-            * global_const.PX_R
-        )
+        _x, _y = map(int, self.xy_abs_r(radius))
+        _d = geometry.stamp_offset(radius)
         return (_x - _d, _y - _d)
 
     @property
     def xy_abs(self):
         "absolute coordinate on the canvas (for drawing)"
-        _x = self.point_x * global_const.PX_R * 1.5
-        _y = ((self.point_x // 2 - self.point_x / 2)
-              * global_const.PX_R * 2
-              * global_const.PX_RATIO + 2 * self.point_y
-              * global_const.PX_R * global_const.PX_RATIO)
-        return (_x, _y)
+        return geometry.center(self.point_x, self.point_y)
+
+    def xy_abs_r(self, radius=global_const.PX_R):
+        "absolute coordinate on the canvas of hexagons of the radius"
+        return geometry.center(self.point_x, self.point_y, radius)
+
+    @classmethod
+    def from_axial(cls, _q: int, _r: int):
+        "the pos of axial coordinates (q, r)"
+        return cls(*hexcoord.axial_to_offset(_q, _r))
+
+    @property
+    def axial(self):
+        "axial coordinates (q, r)"
+        return hexcoord.offset_to_axial(self.point_x, self.point_y)
+
+    @property
+    def cube(self):
+        "cube coordinates (q, r, s), q + r + s == 0"
+        _q, _r = self.axial
+        return (_q, _r, -_q - _r)
+
+    def neighbors(self):
+        "the 6 pos around (may be outside the map)"
+        return [Pos(_x, _y)
+                for _x, _y in hexcoord.neighbors(self.point_x, self.point_y)]
+
+    def distance(self, other):
+        "number of steps to the other pos (or tuple (_x, _y))"
+        if isinstance(other, Pos):
+            other = other.pos_tuple
+        return hexcoord.distance(self.point_x, self.point_y,
+                                 other[0], other[1])
+
+    def ring(self, radius: int):
+        "all pos exactly `radius` steps away, in ring order"
+        return [Pos(_x, _y) for _x, _y in
+                hexcoord.ring(self.point_x, self.point_y, radius)]
+
+    def range(self, radius: int):
+        "all pos within `radius` steps (including itself)"
+        return [Pos(_x, _y) for _x, _y in
+                hexcoord.hex_range(self.point_x, self.point_y, radius)]
 
     @property
     def str_x(self):
         "the text version of _x coordinate"
         if self.point_x <= 0:
             return ""
-        x_lst = []
-        tmp_x = self.point_x
-        for _ in range(int(log(self.point_x, 26))+1):
-            tmp_x, this = divmod(tmp_x, 26)
-            x_lst.append(this + 0x40)
-        x_ascii = bytes(x_lst.__iter__())
-        return x_ascii.decode(encoding="utf-8")
+        return _x_to_label(self.point_x)
 
     @property
     def pos_tuple(self):
@@ -138,9 +240,7 @@ class Pos:
     @property
     def show_pos(self) -> str:
         "the output version of pos on the grid"
-        if self.point_x <= 0:
-            return ""
-        return f"{self.str_x}{self.point_y}"
+        return pos_label(self.point_x, self.point_y)
 
     def __eq__(self, __o):
         if isinstance(__o, Pos):  # type(__o) is Pos:
@@ -177,6 +277,11 @@ class PosConf:
         elif tag == "<player>":
             self.player = data
 
+    @property
+    def is_empty(self):
+        "nothing on this hexagon"
+        return self.floor is None and self.item is None and self.player is None
+
     def print_on_img(self, map_canvas):
         """draw all the things in this hexagon on canvas
         (`create_grid_pic.MapCanvas`)"""
@@ -188,26 +293,198 @@ class PosConf:
             map_canvas.draw_single_player(self.player)
 
 
-class Grid(dict):
-    def __init__(self, map_save_dict: dict = None):
+def _columns_of_rows(rows, names):
+    "{name: values} of rows holding the fields `names` in order"
+    rows = [tuple(row) for row in rows]
+    for row in rows:
+        if len(row) != len(names):
+            raise ValueError(f"{row} does not have the fields {names}")
+    return {name: [row[index] for row in rows]
+            for index, name in enumerate(names)}
+
+
+def _read_csv_columns(path, line_fields):
+    """{name: values} of a CSV file, its first row may name the columns
+    (the `line_fields`, 'x' and 'y' may replace 'pos')"""
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = [row for row in csv.reader(file) if row]
+    names = tuple(line_fields)
+    if rows and {field.strip() for field in rows[0]} <= \
+            set(line_fields) | {"x", "y"}:
+        names = tuple(field.strip() for field in rows.pop(0))
+    return _columns_of_rows(rows, names)
+
+
+def _stamp_type(value: str):
+    "the stamp id of a marker type name or id"
+    if value in global_const.RESOURCE_STAMP_TYPE:
+        return global_const.RESOURCE_STAMP_TYPE.index(value)
+    return int(value)
+
+
+class ListenerMixin:
+    """`add_listener` / `remove_listener` of the row changes, the class
+    keeps the callbacks in a `_listeners` list"""
+    _listeners: list
+
+    def add_listener(self, callback):
+        """call `callback(tag, pos, row)` whenever the row on a pos changes,
+        `row` is None if the pos is cleared"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        "stop notifying `callback`"
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+
+class Grid(ListenerMixin, dict):
+    """the map sections (`loadmap.MapSave.*`) by tag, with a live pos index,
+    its listeners hear the rows of the floors, items and players (the
+    sections loaded later included)"""
+    _index_tags = ("<floor>", "<item>", "<player>")
+
+    def __init__(self, map_save_dict: dict = None, lazy_sections=None):
+        """`lazy_sections`: {tag: callable returning the section}, each one
+        is called on the first access of its section"""
         super().__init__()
-        self.update(map_save_dict)
-        # self._map_data = self.get_map_data()
+        # Pos: PosConf, built on first use and then kept up to date by
+        # the section listeners
+        self._map_data = None
+        self._lazy = {}
+        self._listeners = []
+        # `journal.Journal` of the save file the grid was loaded from
+        self.journal = None
+        if map_save_dict:
+            super().update(map_save_dict)
+            for tag in self._index_tags:
+                if tag in self:
+                    self[tag].add_listener(self._on_section_change)
+        if lazy_sections:
+            for tag, load in lazy_sections.items():
+                super().__setitem__(tag, None)
+                self._lazy[tag] = load
+
+    def _load_section(self, tag):
+        section = self._lazy.pop(tag)()
+        super().__setitem__(tag, section)
+        if tag in self._index_tags:
+            section.add_listener(self._on_section_change)
+
+    def load_all(self):
+        "load all the sections that are not loaded yet"
+        for tag in list(self._lazy):
+            self._load_section(tag)
+
+    def __getitem__(self, tag):
+        if tag in self._lazy:
+            self._load_section(tag)
+        return super().__getitem__(tag)
+
+    def get(self, tag, default=None):
+        if tag in self:
+            return self[tag]
+        return default
+
+    def values(self):
+        self.load_all()
+        return super().values()
+
+    def items(self):
+        self.load_all()
+        return super().items()
+
+    def __setitem__(self, tag, section):
+        if tag in self._lazy:
+            del self._lazy[tag]
+        elif tag in self._index_tags and tag in self:
+            self[tag].remove_listener(self._on_section_change)
+        super().__setitem__(tag, section)
+        if tag in self._index_tags:
+            section.add_listener(self._on_section_change)
+            self._map_data = None
+
+    def __delitem__(self, tag):
+        self._lazy.pop(tag, None)
+        super().__delitem__(tag)
+
+    def _on_section_change(self, tag, pos, row):
+        "update the pos index when a row of the section changes"
+        for callback in self._listeners:
+            callback(tag, pos, row)
+        if self._map_data is None:
+            return
+        pos_conf = self._map_data.get(pos)
+        if pos_conf is None:
+            if row is None:
+                return
+            pos_conf = PosConf(pos=pos)
+            self._map_data[pos] = pos_conf
+        pos_conf.set_data(tag=tag, data=row)
+        if pos_conf.is_empty:
+            del self._map_data[pos]
 
     def get_pos(self, pos: Pos):
-        "still generates all the map datas"
-        map_data = self.get_map_data()
-        if pos in map_data:
-            return map_data[pos]
-        return PosConf(pos=pos)
+        "get the `PosConf` on the pos (an empty one if nothing is there)"
+        if self._map_data is not None:
+            pos_conf = self._map_data.get(pos)
+            return pos_conf if pos_conf is not None else PosConf(pos=pos)
+        # the sections are indexed by pos, no need to walk the whole map
+        ret = PosConf(pos=pos)
+        for tag in self._index_tags:
+            if tag in self:
+                ret.set_data(tag, self[tag].get_on_pos(pos))
+        return ret
+
+    def import_rows(self, tag, source):
+        """set many floors, items or players at once, each on its own pos
+        (the last one wins), return the number of rows imported
+        `source`: the path of a CSV file or an iterable of tuples, holding
+            the fields of the save file lines (a first CSV row naming the
+            fields gives them in any order, 'x' and 'y' may replace 'pos'),
+            or a numpy array (structured with the field names, or 2d with
+            the columns of the `columnar` dtype of the section)
+        colors are color ids or '#rgb' (added to <color> if new) and marker
+        types stamp ids or names, each distinct one is resolved once
+        the items and players without ids are numbered after the others"""
+        section = self[tag]
+        codec = section.codec_cls()
+        if isinstance(source, (str, os.PathLike)):
+            columns = _read_csv_columns(source, codec.line_fields)
+        elif isinstance(source, np.ndarray) and source.dtype.names:
+            columns = {name: source[name] for name in source.dtype.names}
+        elif isinstance(source, np.ndarray):
+            columns = dict(zip(codec.dtype.names, np.atleast_2d(source).T))
+        else:
+            columns = _columns_of_rows(source, codec.line_fields)
+        if "id" in codec.dtype.names and "id" not in columns:
+            start = len(section.data) + 1
+            size = len(next(iter(columns.values()), ()))
+            columns["id"] = list(range(start, start + size))
+        colors = self["<color>"]
+        records = codec.records_of_columns(columns, {
+            "color": lambda value: colors.add_color(value)
+            if value.startswith("#") else int(value),
+            "type": _stamp_type,
+        })
+        section.set_records(records, codec.strings)
+        return len(records)
 
     def get_map_data(self, gridobj=None):
         "get all markers on the map according to pos"
-        if gridobj is None:
-            gridobj = self
+        if gridobj is None or gridobj is self:
+            if self._map_data is None:
+                self._map_data = self._build_map_data(self)
+            return self._map_data
+        return self._build_map_data(gridobj)
+
+    @classmethod
+    def _build_map_data(cls, gridobj):
+        "walk all the rows of `gridobj` and build the pos index"
         tmp_data_dict = {}   # Pos: PosConf
-        # tmp_data_dict["color"] = gridobj["<color>"]
-        for tag in ["<floor>", "<item>", "<player>"]:
+        for tag in cls._index_tags:
+            if tag not in gridobj:
+                continue
             for data in gridobj[tag].get_data_iter():
                 if data.pos in tmp_data_dict:
                     tmp_data_dict[data.pos].set_data(tag=tag, data=data)
@@ -217,10 +494,33 @@ class Grid(dict):
                     tmp_data_dict[data.pos] = this_pos_conf
         return tmp_data_dict
 
-    def save(self, path, encoding="utf-8"):
-        # TODO: save map
-        "save the hexmap"
-        with open(path, mode="w", encoding=encoding) as file:
+    def save(self, path, encoding="utf-8", binary=False, compress=None,
+             floor_runs=False):
+        """save the hexmap, only the edits are appended to the journal when
+        the grid was loaded from `path` (see journal.py)
+        the options are the ones of `write_file`"""
+        if self.journal is not None and self.journal.handles(path):
+            self.journal.save(binary=binary, compress=compress,
+                              floor_runs=floor_runs)
+            return
+        self.write_file(path, encoding, binary, compress, floor_runs)
+
+    def write_file(self, path, encoding="utf-8", binary=False, compress=None,
+                   floor_runs=False):
+        """write the whole hexmap (the file is replaced only when all is
+        written)
+        `binary`: in the binary format (binsave.py)
+        `compress`: stream the text through 'gzip', 'bz2' or 'lzma'
+        `floor_runs`: write the floors as runs of a column
+            (`loadmap.MapSave.FloorRuns`), much smaller for dense maps"""
+        if binary:
+            if compress is not None:
+                raise ValueError("binary saves are mapped, not compressed")
+            with misc.replace_file(path, mode="wb") as file:
+                binsave.write(file, self)
+            return
+        with misc.replace_file(path, mode="w", encoding=encoding,
+                               compress=compress) as file:
             file.writelines(global_const.SAVE_FILE_HEADER)
             tag_list = [
                 "<set>", "<color>", "<floor>", "<item>", "<user>", "<player>"
@@ -228,11 +528,27 @@ class Grid(dict):
             for tag in tag_list:
                 data = self[tag]
                 # print(tag, data)
-                file.writelines(data.get_save_iter())
+                if floor_runs and tag == "<floor>":
+                    file.writelines(data.get_runs_iter())
+                else:
+                    file.writelines(data.get_save_iter())
 
 
 class MapGridElementTemplate:
     "basic hexgrid row element template"
+    __slots__ = ()
+
+    def __getstate__(self):
+        # slotted (and frozen) rows cannot be pickled by setattr
+        return {
+            name: getattr(self, name) for cls in type(self).__mro__
+            for name in getattr(cls, "__slots__", ())
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            _set_slot(self, name, value)
+
     class _RowIter:
         # "the iter generater class, write __iter__ in the main cls to use it"
         def __init__(self, data_list):
@@ -252,45 +568,59 @@ class MapGridElementTemplate:
 
 class Node:
     "All the map nodes, the lines in the save file"
-    @dataclass
+    @dataclass(frozen=True)
     class Floor(MapGridElementTemplate):
         "the color of a specific hexagon grid"
+        __slots__ = ("pos", "color")
         pos: Pos
         color: Any
 
+        def move_to(self, pos: Pos):
+            "the same floor on another pos"
+            return Node.Floor(pos=pos, color=self.color)
+
         def __iter__(self):
             return self._RowIter(
                 [self.pos, self.color]
             )
 
-    @dataclass
+    @dataclass(frozen=True)
     class Set(MapGridElementTemplate):
         "settings of the map"
+        __slots__ = ("x_max", "y_max", "_r", "name")
         x_max: int
         y_max: int
-        _r: int      # TODO: 存档六角格半径可变
+        _r: int      # hexagon radius (px)
         name: str
 
+        @property
+        def radius(self):
+            "the radius of the hexagons"
+            return self._r
+
         @property
         def size(self):
-            _x = global_const.PX_R * 1.5 * (self.x_max + 0.7)
-            _y = (global_const.PX_R * global_const.PX_RATIO
-                  * (self.y_max + 0.5) * 2)
-            return (int(_x), int(_y))
+            return geometry.canvas_size(self.x_max, self.y_max, self._r)
 
         def __iter__(self):
             return self._RowIter([self.x_max, self.y_max,
                                   self._r, self.name])
 
-    @dataclass
+    @dataclass(frozen=True)
     class Item(MapGridElementTemplate):  # TODO: load google icons
         "the items put on the map"
+        __slots__ = ("id", "name", "color", "type", "pos")
         id: int
         name: str
         color: int
         type: int
         pos: Pos
 
+        def move_to(self, pos: Pos):
+            "the same item on another pos"
+            return Node.Item(id=self.id, name=self.name, color=self.color,
+                             type=self.type, pos=pos)
+
         def __iter__(self):
             return self._RowIter(
                 [str(_x) for _x in (
@@ -299,18 +629,20 @@ class Node:
                 )]
             )
 
-    @dataclass
+    @dataclass(frozen=True)
     class User(MapGridElementTemplate):  # TODO: user set
         "users on the map (currently useless)"
+        __slots__ = ("uid", "hash")
         uid: str
         hash: str
 
         def __iter__(self):
             return self._RowIter([self.uid, self.hash])
 
-    @dataclass
+    @dataclass(frozen=True)
     class Player(MapGridElementTemplate):   # TODO: player
         "user players on the map (currently same as `item`)"
+        __slots__ = ("id", "name", "uid", "color", "type", "pos")
         id: int
         name: str
         uid: str
@@ -318,6 +650,11 @@ class Node:
         type: int
         pos: Pos
 
+        def move_to(self, pos: Pos):
+            "the same player on another pos"
+            return Node.Player(id=self.id, name=self.name, uid=self.uid,
+                               color=self.color, type=self.type, pos=pos)
+
         def __iter__(self):
             return self._RowIter(
                 [str(_x) for _x in (
@@ -329,6 +666,7 @@ class Node:
     @dataclass
     class Color(MapGridElementTemplate):    # TODO: color save and order
         "colors used by `floor` (and `item`, `player` in the future)"
+        __slots__ = ("color",)
         # NOTE: UNSTABLE, WILL CHANGE IN THE FUTURE
         # self.id = int(row_data_list[0])
         color: str
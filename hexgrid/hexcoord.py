@@ -0,0 +1,183 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# hexagon coordinate math: offset (_x, _y) <-> axial (q, r) / cube (q, r, s)
+# the offset coordinates are columns (_x) and rows (_y), odd columns are
+# shifted half a hexagon up (see `geometry.center`)
+#
+# the batch functions take arrays of positions and return flat arrays:
+# `src` (the index of the input position each result belongs to) and
+# `cells` (flat cell index `_x * (y_max + 1) + _y`, see `cell_index`)
+# cells outside the map (0 <= _x <= x_max, 1 <= _y <= y_max) are dropped
+
+import numpy as np
+
+# the 6 neighbor directions in axial coordinates, counterclockwise
+# `ring` walks them in this order
+AXIAL_DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+
+def offset_to_axial(_x, _y):
+    "offset (_x, _y) -> axial (q, r), works for ints and numpy arrays"
+    return (_x, _y - (_x + (_x & 1)) // 2)
+
+
+def axial_to_offset(_q, _r):
+    "axial (q, r) -> offset (_x, _y), works for ints and numpy arrays"
+    return (_q, _r + (_q + (_q & 1)) // 2)
+
+
+def axial_distance(q_1, r_1, q_2, r_2):
+    "number of steps between two hexagons in axial coordinates"
+    d_q = q_1 - q_2
+    d_r = r_1 - r_2
+    if isinstance(d_q, np.ndarray) or isinstance(d_r, np.ndarray):
+        return (np.abs(d_q) + np.abs(d_r) + np.abs(d_q + d_r)) // 2
+    return (abs(d_q) + abs(d_r) + abs(d_q + d_r)) // 2
+
+
+def distance(x_1, y_1, x_2, y_2):
+    "number of steps between two hexagons in offset coordinates"
+    return axial_distance(*offset_to_axial(x_1, y_1),
+                          *offset_to_axial(x_2, y_2))
+
+
+def ring_axial(radius: int):
+    "axial offsets of the ring around (0, 0), in ring order from the start"
+    if radius <= 0:
+        return [(0, 0)]
+    d_q, d_r = AXIAL_DIRECTIONS[4]
+    _q, _r = d_q * radius, d_r * radius
+    ret = []
+    for d_q, d_r in AXIAL_DIRECTIONS:
+        for _ in range(radius):
+            ret.append((_q, _r))
+            _q += d_q
+            _r += d_r
+    return ret
+
+
+def range_axial(radius: int):
+    "axial offsets of all hexagons within `radius` steps of (0, 0)"
+    ret = []
+    for _q in range(-radius, radius + 1):
+        for _r in range(max(-radius, -_q - radius),
+                        min(radius, -_q + radius) + 1):
+            ret.append((_q, _r))
+    return ret
+
+
+def neighbors(_x, _y):
+    "offset coordinates of the 6 neighbors"
+    _q, _r = offset_to_axial(_x, _y)
+    return [axial_to_offset(_q + d_q, _r + d_r)
+            for d_q, d_r in AXIAL_DIRECTIONS]
+
+
+def ring(_x, _y, radius: int):
+    "offset coordinates of the ring `radius` steps away"
+    _q, _r = offset_to_axial(_x, _y)
+    return [axial_to_offset(_q + d_q, _r + d_r)
+            for d_q, d_r in ring_axial(radius)]
+
+
+def hex_range(_x, _y, radius: int):
+    "offset coordinates of all hexagons within `radius` steps"
+    _q, _r = offset_to_axial(_x, _y)
+    return [axial_to_offset(_q + d_q, _r + d_r)
+            for d_q, d_r in range_axial(radius)]
+
+
+def axial_round(_q: float, _r: float):
+    "the hexagon (axial) containing the fractional axial coordinates"
+    _s = -_q - _r
+    r_q, r_r, r_s = round(_q), round(_r), round(_s)
+    d_q, d_r, d_s = abs(r_q - _q), abs(r_r - _r), abs(r_s - _s)
+    if d_q > d_r and d_q > d_s:
+        r_q = -r_r - r_s
+    elif d_r > d_s:
+        r_r = -r_q - r_s
+    return (r_q, r_r)
+
+
+def line(x_1, y_1, x_2, y_2):
+    "offset coordinates of the hexagons on the line between two hexagons"
+    q_1, r_1 = offset_to_axial(x_1, y_1)
+    q_2, r_2 = offset_to_axial(x_2, y_2)
+    steps = axial_distance(q_1, r_1, q_2, r_2)
+    if steps == 0:
+        return [(x_1, y_1)]
+    ret = []
+    for i in range(steps + 1):
+        _t = i / steps
+        # nudge the points so that they never fall on an edge
+        ret.append(axial_to_offset(*axial_round(
+            q_1 + (q_2 - q_1) * _t + 1e-6, r_1 + (r_2 - r_1) * _t + 1e-6)))
+    return ret
+
+
+# batch versions ##############################################################
+
+def cell_index(xs, ys, y_max):
+    "flat cell index of offset coordinates"
+    return np.asarray(xs, dtype=np.int64) * (y_max + 1) + ys
+
+
+def cell_xy(cells, y_max):
+    "offset coordinates (xs, ys) of flat cell indexes"
+    return np.divmod(np.asarray(cells, dtype=np.int64), y_max + 1)
+
+
+def in_map(xs, ys, x_max, y_max):
+    "bool mask of the positions inside the map"
+    return (xs >= 0) & (xs <= x_max) & (ys >= 1) & (ys <= y_max)
+
+
+def _expand(xs, ys, axial_offsets, x_max, y_max):
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    offsets = np.asarray(axial_offsets, dtype=np.int64).reshape(-1, 2)
+    _q, _r = offset_to_axial(xs, ys)
+    all_q = (_q[:, None] + offsets[None, :, 0]).ravel()
+    all_r = (_r[:, None] + offsets[None, :, 1]).ravel()
+    src = np.repeat(np.arange(len(xs), dtype=np.int64), len(offsets))
+    out_x, out_y = axial_to_offset(all_q, all_r)
+    inside = in_map(out_x, out_y, x_max, y_max)
+    return (src[inside], cell_index(out_x[inside], out_y[inside], y_max))
+
+
+def neighbors_batch(xs, ys, x_max, y_max):
+    "(src, cells) of the neighbors of every position"
+    return _expand(xs, ys, AXIAL_DIRECTIONS, x_max, y_max)
+
+
+def ring_batch(xs, ys, radius, x_max, y_max):
+    "(src, cells) of the ring `radius` steps away of every position"
+    return _expand(xs, ys, ring_axial(radius), x_max, y_max)
+
+
+def range_batch(xs, ys, radius, x_max, y_max):
+    "(src, cells) of all hexagons within `radius` steps of every position"
+    return _expand(xs, ys, range_axial(radius), x_max, y_max)
+
+
+def distance_batch(xs, ys, x_0, y_0):
+    "steps from every position to (x_0, y_0)"
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    return distance(xs, ys, x_0, y_0)
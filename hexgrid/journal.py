@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# append-only journal of the edits of a save file, kept next to it in
+# `<save path>.journal` (utf-8 text, one edit per line)
+#
+#   +<tag>|<row>        the row is set on its pos (the save file line)
+#   -<tag>|<_x>|<_y>    the pos is cleared
+#
+# only the floor, item and player edits are journaled, a change of the other
+# sections compacts the journal into the save file on the next save
+# the edits set or clear a whole pos, replaying a journal twice gives the
+# same map: a crash between the compaction of the save file and the removal
+# of the journal is harmless
+# a last line without its line end was cut by a crash and is dropped
+
+import os
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_TAGS = ("<floor>", "<item>", "<player>")
+OTHER_TAGS = ("<set>", "<color>", "<user>")
+_EDIT_BYTES = 24    # the size of an edit line, guessed before it is written
+
+
+def journal_path(path):
+    "the journal of the save file"
+    return f"{path}{JOURNAL_SUFFIX}"
+
+
+def read_entries(path):
+    "{tag: [(op, payload)]} of the journal of the save file, in order"
+    try:
+        with open(journal_path(path), "rb") as file:
+            raw = file.read()
+    except FileNotFoundError:
+        return {}
+    ret = {}
+    # only "\n" ends an entry (not the other line breaks of splitlines)
+    for line in raw[:raw.rfind(b"\n") + 1].decode("utf-8").split("\n"):
+        if not line:
+            continue
+        tag, _, payload = line[1:].partition("|")
+        ret.setdefault(tag, []).append((line[0], payload))
+    return ret
+
+
+def replay_section(section, entries):
+    "apply the journal entries of the section, return the section"
+    for op, payload in entries or ():
+        if op == "+":
+            row = section.row_from_line(payload)
+            section.set_on_pos(row.pos, row)
+        elif op == "-":
+            _x, _y = payload.split("|")
+            section.remove_on_pos((int(_x), int(_y)))
+    return section
+
+
+def replayed(load, entries):
+    "wrap the loader of a lazy section so that its entries are replayed"
+    if not entries:
+        return load
+    return lambda: replay_section(load(), entries)
+
+
+def _drop_torn_line(path):
+    "cut a line left without its line end by a crash"
+    try:
+        with open(path, "r+b") as file:
+            raw = file.read()
+            end = raw.rfind(b"\n") + 1
+            if end != len(raw):
+                file.truncate(end)
+    except FileNotFoundError:
+        pass
+
+
+class Journal:
+    """the edits of a grid loaded from `path` since it was saved, `save`
+    appends them to the journal instead of rewriting the save file
+    `save_options`: the `Grid.write_file` options of the save file
+    `compact_ratio`: the journal is folded into the save file when it grows
+        bigger than this part of the save file"""
+
+    def __init__(self, grid, path, encoding="utf-8", save_options=None,
+                 compact_ratio=0.5):
+        self.grid = grid
+        self.path = os.path.abspath(path)
+        self.encoding = encoding
+        self.save_options = dict(save_options or {})
+        self.compact_ratio = compact_ratio
+        self._pending = []  # (tag, pos, row) not written yet
+        self._others = self._other_lines()
+        _drop_torn_line(journal_path(self.path))
+        grid.add_listener(self._on_change)
+
+    def close(self):
+        "stop recording the edits"
+        self.grid.remove_listener(self._on_change)
+
+    def _other_lines(self):
+        return {tag: list(self.grid[tag]) for tag in OTHER_TAGS
+                if tag in self.grid}
+
+    def _on_change(self, tag, pos, row):
+        # the rows are immutable, the lines are only made when written
+        self._pending.append((tag, pos, row))
+
+    @staticmethod
+    def _line(tag, pos, row):
+        if row is None:
+            if not isinstance(pos, tuple):
+                pos = pos.pos_tuple
+            return f"-{tag}|{pos[0]}|{pos[1]}\n"
+        return f"+{tag}|{'|'.join(row)}\n"
+
+    @property
+    def pending(self):
+        "number of the edits not saved yet"
+        return len(self._pending)
+
+    def handles(self, path):
+        "a save of the grid to `path` goes through the journal"
+        return os.path.abspath(path) == self.path
+
+    def _needs_compact(self):
+        if not os.path.isfile(self.path):
+            return True
+        if self._other_lines() != self._others:
+            return True
+        name = journal_path(self.path)
+        size = os.path.getsize(name) if os.path.isfile(name) else 0
+        size += _EDIT_BYTES * len(self._pending)
+        return size > self.compact_ratio * os.path.getsize(self.path)
+
+    def save(self, **save_options):
+        """append the edits to the journal, or compact it when it is too big
+        `save_options`: the `Grid.write_file` options, the save file is
+            compacted if they change"""
+        if save_options != self.save_options:
+            self.save_options = save_options
+            self.compact()
+            return
+        if self._needs_compact():
+            self.compact()
+            return
+        if not self._pending:
+            return
+        with open(journal_path(self.path), "a", encoding="utf-8",
+                  newline="\n") as file:
+            file.writelines([self._line(*edit) for edit in self._pending])
+            file.flush()
+            os.fsync(file.fileno())
+        self._pending.clear()
+
+    def compact(self):
+        "write the whole map to the save file and start a new journal"
+        self.grid.write_file(self.path, self.encoding, **self.save_options)
+        # the save file is synced to the disk (`misc.replace_file`), only
+        # then its journal can go
+        self.reset()
+
+    def reset(self):
+        "the save file was just written with the whole map, drop the journal"
+        name = journal_path(self.path)
+        if os.path.exists(name):
+            os.remove(name)
+        self._pending.clear()
+        self._others = self._other_lines()
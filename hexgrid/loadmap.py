@@ -16,33 +16,62 @@
    limitations under the License.
 """
 
+import functools
+import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from PIL import ImageColor
 
 from hexgrid import global_const
 
 # import hexgrid
-from . import gridcls, misc
+from . import binsave, columnar, gridcls, journal, misc
 
 Node = gridcls.Node
 unescape = misc.unescape
 
+_TAG_RE = re.compile(r"^(\<\w+\>)+$")
+_TAG_LINE_RE = re.compile(rb"^(?:<\w+>)+\r?$", re.M)
+_READ_SIZE = 1 << 20    # characters read from the save file at once
+_BATCH_LINES = 1 << 14  # lines fed to the sections at once
+_PARALLEL_MIN_BYTES = 1 << 20   # smaller sections are parsed in one piece
+_PARALLEL_PIECES = 4    # pieces of a big section per worker
+
 
-class _MapSaveClsTemplate:
+class _MapSaveClsTemplate(gridcls.ListenerMixin):
     def __init__(self, tag="<unknown>"):
         self.tag = tag
         self.data = []
+        self._listeners = []
+
+    def _notify(self, pos, row):
+        for callback in self._listeners:
+            callback(self.tag, pos, row)
 
     def feed_line(self, line: str):
-        tmp_lst_1 = line.split("|")
-        tmp_lst_2 = []
-        for tmp_line in tmp_lst_1:
-            tmp_lst_2.append(unescape(tmp_line))
-        res = self._data_line(tmp_lst_2)
-        self.data.append(res)
+        self.feed_lines([line])
+
+    def feed_lines(self, lines):
+        "feed a batch of lines (without the line end) of this section"
+        add_row = self._add_row
+        for fields in _split_lines(lines):
+            add_row(self._data_line(fields))
+
+    def _add_row(self, row):
+        "append a row loaded from the save file"
+        self.data.append(row)
 
     def add_line(self, *arg):
         self._data_line(arg)
 
+    def row_from_line(self, line: str):
+        "the row of a save file line of this section"
+        return self._data_line(next(_split_lines([line])))
+
     def _data_line(self, this_line_list):
         "override this to set data class"
         return self._MapSaveRow(this_line_list)
@@ -55,23 +84,12 @@ class _MapSaveClsTemplate:
         "get an iterator returning data node obj"
         return self._MapDataIter(self)
 
-    def set_on_pos(self, pos, data):
-        "set node data on the pos"
-        index = 0
-        for i in self.get_data_iter():
-            if i.pos == pos:
-                self.data[index] = data
-                index = -1
-                break
-            index += 1
-        if index != -1:
-            self.data.append(data)
-
     def __iter__(self):
         return self._MapSaveIter(self, need_tag=False)
 
     class _MapSaveRow(gridcls.MapGridElementTemplate):
         "basic_tamplate"
+        __slots__ = ()
 
     class _MapDataIter:
         def __init__(self, map_obj) -> None:
@@ -113,18 +131,281 @@ class _MapSaveClsTemplate:
             return ret+"\n"
 
 
+def _split_lines(lines):
+    "the unescaped fields of the lines, empty lines are skipped"
+    for line in lines:
+        if not line:
+            continue
+        fields = line.split("|")
+        if "&" in line:
+            # only the escaped lines need it
+            fields = [unescape(field) for field in fields]
+        yield fields
+
+
+def _pos_key(pos):
+    "the hashable key of a `gridcls.Pos` (or a tuple (_x, _y))"
+    if isinstance(pos, gridcls.Pos):
+        return (pos.point_x, pos.point_y)
+    return (int(pos[0]), int(pos[1]))
+
+
+class _MapSavePosClsTemplate(_MapSaveClsTemplate):
+    """template of the sections whose rows are put on a pos (floor, item,
+    player), rows are indexed by pos so that set / remove are O(1)
+
+    with `columnar_mode=True` the rows are stored in numpy arrays
+    (`columnar.ColumnRows`) and `self.data` is a lazy view of row objects
+
+    NOTE: if the save file has several rows on the same pos, only the last
+    one is kept, the rows it shadows are dropped when they are indexed"""
+    codec_cls = columnar.RowCodec   # the codec of the columnar rows
+
+    def __init__(self, tag="<unknown>", columnar_mode=False):
+        super().__init__(tag)
+        self._pos_index = {}    # (_x, _y): index of the row in self.data
+        if columnar_mode:
+            self.data = columnar.ColumnRows(self.codec_cls())
+            self._pos_index = columnar.DensePosIndex()
+
+    @property
+    def is_columnar(self):
+        "the rows are stored in numpy arrays"
+        return isinstance(self.data, columnar.ColumnRows)
+
+    def _add_row(self, row):
+        # a row on a pos already set replaces it (the last one wins)
+        key = _pos_key(row.pos)
+        index = self._pos_index.get(key)
+        if index is None:
+            self._pos_index[key] = len(self.data)
+            self.data.append(row)
+        else:
+            self.data[index] = row
+        if self._listeners:
+            self._notify(row.pos, row)
+
+    def _extend_records(self, array):
+        """append the records to the columnar rows (no listeners), the rows
+        they shadow are dropped"""
+        start = len(self.data)
+        known = self._pos_index.get_many(array["x"], array["y"])
+        self.data.extend_records(array)
+        self._pos_index.set_rows(array["x"], array["y"], start)
+        if (known >= 0).any() or (self._pos_index.get_many(
+                array["x"], array["y"]) != np.arange(
+                    start, start + len(array))).any():
+            self._drop_shadowed()
+
+    def _drop_shadowed(self):
+        """keep only the indexed row of each pos (the last one), the index
+        must be up to date"""
+        if self.is_columnar:
+            array = self.data.array
+            live = self._pos_index.get_many(array["x"], array["y"]) == \
+                np.arange(len(array))
+            if live.all():
+                return
+            array = array[live]
+            self.data = columnar.ColumnRows.from_array(self.data.codec, array)
+            self._pos_index = columnar.DensePosIndex.from_columns(
+                array["x"], array["y"], self._pos_index.origin)
+            return
+        if len(self._pos_index) == len(self.data):
+            return
+        self.data = [self.data[index]
+                     for index in sorted(self._pos_index.values())]
+        self._pos_index = {
+            _pos_key(row.pos): index for index, row in enumerate(self.data)
+        }
+
+    def feed_lines(self, lines):
+        if self._listeners:
+            super().feed_lines(lines)
+            return
+        data = self.data
+        if self.is_columnar:
+            self._extend_records(data.codec.parse_many(_split_lines(lines)))
+            return
+        start = len(data)
+        data_line = self._data_line
+        data.extend([data_line(fields) for fields in _split_lines(lines)])
+        indexed = len(self._pos_index)
+        self._pos_index.update(zip(
+            [(row.pos.point_x, row.pos.point_y) for row in data[start:]],
+            range(start, len(data))
+        ))
+        if len(self._pos_index) - indexed != len(data) - start:
+            self._drop_shadowed()
+
+    def set_columns(self, array, strings: columnar.StringTable = None,
+                    origin=(0, 0)):
+        """replace the rows with a structured array of records (the
+        `codec_cls` dtype, not copied), the section becomes columnar
+        `origin`: the smallest (_x, _y) expected (see `reindex`)"""
+        self.data = columnar.ColumnRows.from_array(
+            self.codec_cls(strings), array)
+        self.reindex(origin)
+
+    def reindex(self, origin=(0, 0)):
+        """rebuild the pos index after `self.data` is changed directly
+        `origin`: in columnar mode, the index array starts there (for the
+        sections holding a part of the map)"""
+        if self.is_columnar:
+            array = self.data.array
+            self._pos_index = columnar.DensePosIndex.from_columns(
+                array["x"], array["y"], origin)
+        else:
+            self._pos_index = {
+                _pos_key(row.pos): index
+                for index, row in enumerate(self.data)
+            }
+        self._drop_shadowed()
+
+    def has_pos(self, pos):
+        "there is a row on the pos"
+        return _pos_key(pos) in self._pos_index
+
+    def get_on_pos(self, pos):
+        "get the node data on the pos (None if there is nothing)"
+        index = self._pos_index.get(_pos_key(pos))
+        if index is None:
+            return None
+        return self.data[index]
+
+    def set_on_pos(self, pos, data):
+        "set node data on the pos"
+        key = _pos_key(pos)
+        index = self._pos_index.get(key)
+        if index is None:
+            self._pos_index[key] = len(self.data)
+            self.data.append(data)
+        else:
+            self.data[index] = data
+        self._notify(data.pos, data)
+
+    def remove_on_pos(self, pos):
+        """remove the node data on the pos and return it (None if there is
+        nothing), the last row is moved into the hole"""
+        index = self._pos_index.pop(_pos_key(pos), None)
+        if index is None:
+            return None
+        data = self.data
+        removed = data[index]
+        last_index = len(data) - 1
+        last = data.pop()
+        if index != last_index:
+            data[index] = last
+            last_key = _pos_key(last.pos)
+            if self._pos_index.get(last_key) == last_index:
+                self._pos_index[last_key] = index
+        self._notify(removed.pos, None)
+        return removed
+
+    def move_on_pos(self, old_pos, new_pos):
+        """move the node data to another pos (replacing what is there),
+        return the moved node data (None if there was nothing to move)"""
+        row = self.remove_on_pos(old_pos)
+        if row is None:
+            return None
+        if not isinstance(new_pos, gridcls.Pos):
+            new_pos = gridcls.Pos(new_pos[0], new_pos[1])
+        row = row.move_to(new_pos)
+        self.set_on_pos(new_pos, row)
+        return row
+
+    def set_records(self, array, strings: columnar.StringTable = None):
+        """set a structured array of records (the `codec_cls` dtype, string
+        fields are ids of `strings`) each on its own pos in one pass, the
+        last one wins if positions repeat"""
+        if len(array) == 0:
+            return
+        if not self.is_columnar:
+            decode = self.codec_cls(strings).decode
+            self.set_many([decode(record) for record in array.tolist()])
+            return
+        codec = self.data.codec
+        array = np.array(array, dtype=codec.dtype)
+        if codec.string_fields and strings is not codec.strings:
+            # the ids of `strings` -> the ids of the section
+            remap = np.array([codec.strings.intern(text)
+                              for text in strings.strings], dtype=np.uint32)
+            for name in codec.string_fields:
+                array[name] = remap[array[name]]
+        # one record per pos: in the slot of the first one, the last value
+        keys = array["x"].astype(np.int64) << 32 | \
+            (array["y"].astype(np.int64) & 0xFFFFFFFF)
+        _, first = np.unique(keys, return_index=True)
+        _, last = np.unique(keys[::-1], return_index=True)
+        order = np.argsort(first)
+        array = array[(len(array) - 1 - last)[order]]
+        indexes = self._pos_index.get_many(array["x"], array["y"])
+        known = indexes >= 0
+        self.data.array[indexes[known]] = array[known]
+        start = len(self.data)
+        self.data.extend_records(array[~known])
+        self._pos_index.set_rows(array["x"][~known], array["y"][~known],
+                                 start)
+        if self._listeners:
+            decode = codec.decode
+            for record in array.tolist():
+                row = decode(record)
+                self._notify(row.pos, row)
+
+    def iter_columns(self):
+        "the rows as `columnar.ColumnRows`, part by part"
+        yield self.get_columns()
+
+    def get_columns(self):
+        """the rows as `columnar.ColumnRows` (`.array` is a structured numpy
+        array of the whole section), no copy in columnar mode"""
+        if self.is_columnar:
+            return self.data
+        return columnar.ColumnRows.from_rows(self.codec_cls(), self.data)
+
+    def set_many(self, rows):
+        "set a batch of node data, each on its own pos, in one pass"
+        data = self.data
+        pos_index = self._pos_index
+        notify = self._notify if self._listeners else None
+        for row in rows:
+            key = _pos_key(row.pos)
+            index = pos_index.get(key)
+            if index is None:
+                pos_index[key] = len(data)
+                data.append(row)
+            else:
+                data[index] = row
+            if notify is not None:
+                notify(row.pos, row)
+
+
+# base of the sections stored elsewhere (see `tiles.TiledSection`)
+PosSectionTemplate = _MapSavePosClsTemplate
+
+
 class MapSave:
     "all the save items loaded, name is just like the gridcls.Node"
     class Color(_MapSaveClsTemplate):
+        """the palette, its listeners are called with the color id in place
+        of the pos when a color is replaced or deleted"""
+
         def __init__(self):
             super().__init__("<color>")
+            self._color_index = {}  # "#rgb": color id, deleted ones excluded
+            self._rgba_cache = {}   # color id: (r, g, b, a)
+
+        def _add_row(self, row):
+            if not row.deleted:
+                # the first one wins, just like list.index
+                self._color_index.setdefault(row.color, len(self.data))
+            self.data.append(row)
 
         def has_color(self, strrgb):
-            if strrgb in self.data:
-                return True
-            return False
+            return strrgb in self._color_index
 
         def get_color(self, color_id: int):
+            color_id = int(color_id)
             if color_id >= len(self.data) or color_id < 0:
                 print(f"ERROR, NO COLOR - {color_id}")
                 print(self.data)
@@ -132,34 +413,95 @@ class MapSave:
                 return "#FFFFFF"
             return self.data[color_id].color
 
+        def get_rgba(self, color_id: int):
+            "the parsed (r, g, b, a) tuple of the color, cached"
+            color_id = int(color_id)
+            rgba = self._rgba_cache.get(color_id)
+            if rgba is None:
+                color = self.get_color(color_id)
+                if color == "_DELETED_":
+                    color = "#FFFFFF"
+                rgba = ImageColor.getcolor(color, "RGBA")
+                self._rgba_cache[color_id] = rgba
+            return rgba
+
         def add_color(self, strrgb):
-            if self.has_color(strrgb):
-                return self.index(strrgb)
-            self.feed_line(strrgb)
-            return self.index(strrgb)
+            "add the color if it is new, return the color id"
+            color_id = self._color_index.get(strrgb)
+            if color_id is None:
+                color_id = len(self.data)
+                self._add_row(self._MapSaveRow([strrgb]))
+            return color_id
+
+        def set_color(self, color_id: int, strrgb):
+            "replace the color, the color id is kept"
+            self._drop_color(color_id)
+            self.data[color_id].setcolor(strrgb)
+            self._color_index.setdefault(strrgb, color_id)
+            self._notify(color_id, self.data[color_id])
+
+        def del_color(self, color_id: int):
+            "mark the color `_DELETED_`, ids of the other colors are kept"
+            self._drop_color(color_id)
+            self._notify(color_id, self.data[color_id])
+
+        def _drop_color(self, color_id):
+            row = self.data[color_id]
+            if self._color_index.get(row.color) == color_id:
+                del self._color_index[row.color]
+                # another row may have the same color
+                for index, other in enumerate(self.data):
+                    if index != color_id and other == row.color:
+                        self._color_index[row.color] = index
+                        break
+            self._rgba_cache.pop(color_id, None)
+            row.delcolor()
 
         def index(self, strrgb):
-            if self.has_color(strrgb):
-                return self.data.index(strrgb)
-            return None
+            return self._color_index.get(strrgb)
 
         class _MapSaveRow(Node.Color):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     color=row_data_list[0]
                 )
 
-    class Floor(_MapSaveClsTemplate):
-        def __init__(self):
-            super().__init__("<floor>")
+    class Floor(_MapSavePosClsTemplate):
+        codec_cls = columnar.FloorCodec
+
+        def __init__(self, columnar_mode=False):
+            super().__init__("<floor>", columnar_mode=columnar_mode)
+
+        def get_runs_iter(self):
+            "the save lines of the floors as runs (see `FloorRuns`)"
+            return floor_run_lines(self)
 
         class _MapSaveRow(Node.Floor):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     pos=gridcls.Pos(row_data_list[0]),
                     color=row_data_list[1]
                 )
 
+    class FloorRuns(Floor):
+        """the floors saved as runs (tag <floorruns>), one line per run of
+        rows on the next hexagons of a column, 'A1|3*5,4,0*2' is A1 to A5 of
+        color 3, A6 of color 4, A7 and A8 of color 0
+        the rows are the same as the ones of <floor> (and saved as them)"""
+
+        def feed_lines(self, lines):
+            array = _expand_floor_runs(lines)
+            if self.is_columnar and not self._listeners:
+                self._extend_records(array)
+                return
+            pos_label = gridcls.pos_label
+            super().feed_lines([f"{pos_label(_x, _y)}|{color}"
+                                for _x, _y, color in array.tolist()])
+
     class Set(_MapSaveClsTemplate):
         def __init__(self):
             super().__init__("<set>")
@@ -176,6 +518,10 @@ class MapSave:
         def name(self):
             return self.data[0].name
 
+        @property
+        def radius(self):
+            return self.data[0].radius
+
         @property
         def size(self):
             return self.data[0].size
@@ -187,19 +533,25 @@ class MapSave:
                 self.data = [node_set,]
 
         class _MapSaveRow(Node.Set):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     x_max=int(row_data_list[0]),
                     y_max=int(row_data_list[1]),
-                    _r=int(row_data_list[2]),      # TODO: 存档六角格半径可变
+                    _r=int(row_data_list[2]),
                     name=row_data_list[3],
                 )
 
-    class Item(_MapSaveClsTemplate):
-        def __init__(self):
-            super().__init__(tag="<item>")
+    class Item(_MapSavePosClsTemplate):
+        codec_cls = columnar.ItemCodec
+
+        def __init__(self, columnar_mode=False):
+            super().__init__(tag="<item>", columnar_mode=columnar_mode)
 
         class _MapSaveRow(Node.Item):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     id=row_data_list[0],
@@ -214,17 +566,23 @@ class MapSave:
             super().__init__(tag="<user>")
 
         class _MapSaveRow(Node.User):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     uid=row_data_list[0],
                     hash=row_data_list[1],
                 )
 
-    class Player(_MapSaveClsTemplate):
-        def __init__(self):
-            super().__init__(tag="<player>")
+    class Player(_MapSavePosClsTemplate):
+        codec_cls = columnar.PlayerCodec
+
+        def __init__(self, columnar_mode=False):
+            super().__init__(tag="<player>", columnar_mode=columnar_mode)
 
         class _MapSaveRow(Node.Player):
+            __slots__ = ()
+
             def __init__(self, row_data_list):
                 super().__init__(
                     id=row_data_list[0],
@@ -243,35 +601,347 @@ __tag_class = {
     "<user>": MapSave.User,
     "<player>": MapSave.Player,
     "<color>": MapSave.Color,
-    "<floor>": MapSave.Floor
+    "<floor>": MapSave.Floor,
+    "<floorruns>": MapSave.FloorRuns,
 }
+__pos_tags = ("<floor>", "<item>", "<player>")
+# the sections saved in another form, by the tag of their save lines
+__section_tag = {"<floorruns>": "<floor>"}
+
+def _section_tag(tag):
+    "the grid tag of the section starting with the tag line"
+    return __section_tag.get(tag, tag)
+
+def floor_run_lines(section):
+    """the save lines of a floor section as runs (`MapSave.FloorRuns`), the
+    rows keep their order"""
+    yield "<floorruns>\n"
+    pos_label = gridcls.pos_label
+    for columns in section.iter_columns():
+        array = columns.array
+        if array.size == 0:
+            continue
+        xs, ys, colors = array["x"], array["y"], array["color"]
+        # a run goes on while the next row is the next hexagon of the column
+        new_run = np.ones(len(array), dtype=bool)
+        new_run[1:] = (xs[1:] != xs[:-1]) | (ys[1:] != ys[:-1] + 1)
+        # and a run is cut into pieces of a single color
+        new_piece = new_run.copy()
+        new_piece[1:] |= colors[1:] != colors[:-1]
+        piece_starts = np.flatnonzero(new_piece)
+        counts = np.diff(np.append(piece_starts, len(array))).tolist()
+        pieces = [
+            f"{color}*{count}" if count > 1 else str(color)
+            for color, count in zip(colors[piece_starts].tolist(), counts)
+        ]
+        run_starts = np.flatnonzero(new_run)
+        bounds = np.searchsorted(piece_starts, run_starts).tolist()
+        bounds.append(len(pieces))
+        for index, (_x, _y) in enumerate(zip(xs[run_starts].tolist(),
+                                             ys[run_starts].tolist())):
+            yield (f"{pos_label(_x, _y)}|"
+                   f"{','.join(pieces[bounds[index]:bounds[index + 1]])}\n")
+
+def _expand_floor_runs(lines):
+    "the floor records (`columnar.FloorCodec` dtype) of floor run lines"
+    xs, ys, colors, counts = [], [], [], []
+    for fields in _split_lines(lines):
+        _x, _y = gridcls.label_to_xy(fields[0])
+        for piece in fields[1].split(","):
+            color, _, count = piece.partition("*")
+            count = int(count) if count else 1
+            xs.append(_x)
+            ys.append(_y)
+            colors.append(int(color))
+            counts.append(count)
+            _y += count
+    counts = np.array(counts, dtype=np.int64)
+    ret = np.empty(int(counts.sum()), dtype=columnar.FloorCodec.dtype)
+    ret["x"] = np.repeat(np.array(xs, dtype=np.int64), counts)
+    ret["color"] = np.repeat(np.array(colors, dtype=np.int64), counts)
+    # the y of its piece + the rank of the row in the piece
+    ret["y"] = np.repeat(np.array(ys, dtype=np.int64), counts) \
+        + np.arange(len(ret)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return ret
 
 def new_file():
     "return an empty grid object of a new file"
     new_file_ = global_const.NEW_FILE_TEMPLATE.splitlines()
     return init_map_data(new_file_)
 
-def load_file(path, encode="utf-8"):
-    "load the hexgrid save file"
-    with open(path, mode="r", encoding=encode) as file:
-        grid = init_map_data(file)
+def load_file(path, encode="utf-8", *, columnar_mode=False, log=None,
+              lazy=True, use_journal=True, workers=None):
+    """load the hexgrid save file, it is read in large chunks
+    `columnar_mode`: keep floors, items and players in numpy arrays
+    `log`: a `misc.LogCls` to report the load speed to
+    `lazy`: only find where the sections are, each one is parsed on the
+        first `Grid[tag]` (the file must not change until all are)
+    `use_journal`: replay the journal of the save file and keep the next
+        edits in it (journal.py), `Grid.save` to `path` only appends them
+    `workers`: parse the big floor, item and player sections in this many
+        processes, all at once and in columnar mode (the same grid as a
+        serial columnar load)
+    binary save files (binsave.py) are always loaded in columnar mode,
+    compressed ones (gzip, bz2, lzma) are streamed through their codec, all
+    at once"""
+    _t = time.perf_counter()
+    entries = journal.read_entries(path) if use_journal else {}
+    compress = misc.compression_of(path)
+    binary = compress is None and binsave.is_binary(path)
+    floor_runs = False
+    if compress is not None:
+        grid = _load_text(path, encode, columnar_mode, log, compress)
+        floor_runs = isinstance(grid.get("<floor>"), MapSave.FloorRuns)
+    elif binary:
+        grid = _load_binary(path)
+        if log is not None:
+            log.info("mapped binary save in {0:.3f}s",
+                     time.perf_counter() - _t)
+    # the section offsets are found in the raw bytes, the encoding must keep
+    # '\n', '<' and '>' as single bytes (not utf-16 ...)
+    elif workers and workers > 1 and "\n<>".encode(encode) == b"\n<>":
+        grid = _load_parallel(path, encode, workers)
+        floor_runs = isinstance(grid.get("<floor>"), MapSave.FloorRuns)
+        if log is not None:
+            log.info("loaded with {0} workers in {1:.3f}s", workers,
+                     time.perf_counter() - _t)
+    elif lazy and "\n<>".encode(encode) == b"\n<>":
+        section_file = _SectionFile(path, encode, columnar_mode)
+        grid = gridcls.Grid(lazy_sections={
+            _section_tag(tag): journal.replayed(
+                section_file.loader(tag), entries.get(_section_tag(tag)))
+            for tag in section_file.ranges
+        })
+        floor_runs = "<floorruns>" in section_file.ranges
+        entries = {}
+        if log is not None:
+            log.info("indexed {0} sections in {1:.3f}s",
+                     len(section_file.ranges), time.perf_counter() - _t)
+    else:
+        grid = _load_text(path, encode, columnar_mode, log)
+        floor_runs = isinstance(grid.get("<floor>"), MapSave.FloorRuns)
+    if use_journal:
+        for tag, tag_entries in entries.items():
+            if tag in grid:
+                journal.replay_section(grid[tag], tag_entries)
+        grid.journal = journal.Journal(grid, path, encode, {
+            "binary": binary, "compress": compress, "floor_runs": floor_runs
+        })
+    return grid
+
+def _load_text(path, encode, columnar_mode, log, compress=None):
+    "load the whole text save file (streamed through `compress`)"
+    _t = time.perf_counter()
+    ret = {}
+    tag = "init"
+    n_lines = 0
+    rest = ""
+    with misc.open_file(path, "r", encode, compress) as file:
+        while True:
+            chunk = file.read(_READ_SIZE)
+            if not chunk:
+                break
+            lines = (rest + chunk).split("\n")
+            # the last line may go on in the next chunk
+            rest = lines.pop()
+            n_lines += len(lines)
+            tag = _feed_batch(ret, tag, lines, columnar_mode)
+    if rest:
+        n_lines += 1
+        _feed_batch(ret, tag, [rest], columnar_mode)
+    grid = gridcls.Grid(ret)
+    if log is not None:
+        used = time.perf_counter() - _t
+        log.info("loaded {0} lines in {1:.3f}s ({2:,.0f} lines/s)",
+                 n_lines, used, n_lines / max(used, 1e-9))
     return grid
 
-def init_map_data(data_string_iter):
+def _scan_sections(file):
+    """{tag: (start, end)} byte range of the lines of every section, the
+    last one wins if a tag repeats (just like a full load)"""
+    found = []  # (tag, start of the tag line, start of the section lines)
+    base = 0
+    rest = b""
+    while True:
+        chunk = file.read(_READ_SIZE)
+        data = rest + chunk
+        # only whole lines, the last one may go on in the next chunk
+        cut = data.rfind(b"\n") + 1 if chunk else len(data)
+        for match in _TAG_LINE_RE.finditer(data, 0, cut):
+            found.append((match.group().rstrip(b"\r").decode("ascii"),
+                          base + match.start(), base + match.end() + 1))
+        if not chunk:
+            break
+        base += cut
+        rest = data[cut:]
+    ranges = {}
+    for index, (tag, _, start) in enumerate(found):
+        if tag not in __tag_class:
+            continue
+        end = found[index + 1][1] if index + 1 < len(found) else base + cut
+        ranges[tag] = (min(start, end), end)
+    return ranges
+
+class _SectionFile:
+    """a text save file whose sections are parsed one by one when they are
+    loaded, the file must not change until all of them are"""
+
+    def __init__(self, path, encode, columnar_mode):
+        self.path = path
+        self.encode = encode
+        self.columnar_mode = columnar_mode
+        with open(path, mode="rb") as file:
+            self.stamp = _file_stamp(file)
+            self.ranges = _scan_sections(file)
+
+    def loader(self, tag):
+        "the callable loading the section"
+        return functools.partial(self.load, tag)
+
+    def load(self, tag):
+        "parse the section, the same as a full load does"
+        start, end = self.ranges[tag]
+        lines = _read_lines(self.path, self.encode, self.stamp, start, end)
+        ret = {}
+        _feed_batch(ret, "init", [tag], self.columnar_mode)
+        for index in range(0, len(lines), _BATCH_LINES):
+            _feed_batch(ret, tag, lines[index:index + _BATCH_LINES],
+                        self.columnar_mode)
+        return ret[_section_tag(tag)]
+
+def _file_stamp(file):
+    stat = os.fstat(file.fileno())
+    return (stat.st_size, stat.st_mtime_ns)
+
+def _read_lines(path, encode, stamp, start, end):
+    "the lines of the byte range, the file must have the same stamp"
+    with open(path, mode="rb") as file:
+        if _file_stamp(file) != stamp:
+            raise RuntimeError(f"'{path}' changed while it was loaded")
+        file.seek(start)
+        text = file.read(end - start).decode(encode)
+    if "\r" in text:
+        # the same as the newline translation of the text mode
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.split("\n")
+
+def _split_range(path, start, end, pieces):
+    "cut the byte range into about `pieces` ranges on line boundaries"
+    bounds = [start]
+    with open(path, mode="rb") as file:
+        for index in range(1, pieces):
+            cut = start + (end - start) * index // pieces
+            if cut <= bounds[-1]:
+                continue
+            # to the start of the next line (`cut` itself if it is one)
+            file.seek(cut - 1)
+            file.readline()
+            cut = file.tell()
+            if bounds[-1] < cut < end:
+                bounds.append(cut)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _parse_range(path, encode, *, stamp, tag, start, end):
+    """parse a piece of a section in a worker process, return the records
+    and the strings their string ids point to"""
+    codec = __tag_class[tag].codec_cls()
+    array = codec.parse_many(
+        _split_lines(_read_lines(path, encode, stamp, start, end)))
+    return (array, codec.strings.strings)
+
+def _merge_pieces(tag, pieces):
+    "the columnar section of the parsed pieces, in order"
+    strings = columnar.StringTable()
+    string_fields = __tag_class[tag].codec_cls.string_fields
+    arrays = []
+    for array, piece_strings in pieces:
+        if string_fields and len(array):
+            # the ids of the piece -> the ids of the section
+            remap = np.array([strings.intern(text) for text in piece_strings],
+                             dtype=np.uint32)
+            for name in string_fields:
+                array[name] = remap[array[name]]
+        arrays.append(array)
+    section = __tag_class[tag](columnar_mode=True)
+    section.set_columns(np.concatenate(arrays), strings)
+    return section
+
+def _load_parallel(path, encode, workers):
+    "load the whole save file, the big pos sections in worker processes"
+    section_file = _SectionFile(path, encode, columnar_mode=True)
+    ret = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for tag, (start, end) in section_file.ranges.items():
+            if tag not in __pos_tags or end - start < _PARALLEL_MIN_BYTES:
+                continue
+            ret[tag] = [
+                pool.submit(_parse_range, path, encode,
+                            stamp=section_file.stamp, tag=tag,
+                            start=piece_start, end=piece_end)
+                for piece_start, piece_end in _split_range(
+                    path, start, end, workers * _PARALLEL_PIECES)
+            ]
+        # the small sections are parsed here while the workers run
+        for tag in section_file.ranges:
+            if tag in ret:
+                continue
+            ret[tag] = section_file.load(tag)
+        for tag in section_file.ranges:
+            if isinstance(ret[tag], list):
+                ret[tag] = _merge_pieces(
+                    tag, [future.result() for future in ret[tag]])
+    return gridcls.Grid({_section_tag(tag): ret[tag]
+                         for tag in section_file.ranges})
+
+def _load_binary(path):
+    sections, strings = binsave.read(path, {
+        tag: __tag_class[tag].codec_cls.dtype for tag in __pos_tags
+    })
+    strings = columnar.StringTable.from_strings(strings)
+    ret = {}
+    for tag, payload in sections.items():
+        if tag in __pos_tags:
+            ret[tag] = __tag_class[tag](columnar_mode=True)
+            ret[tag].set_columns(payload, strings)
+        elif tag in __tag_class:
+            ret[tag] = __tag_class[tag]()
+            ret[tag].feed_lines(payload)
+    return gridcls.Grid(ret)
+
+def init_map_data(data_string_iter, columnar_mode=False):
     "init the map data from a string seperated by lines"
-    re_comp = re.compile(r"^(\<\w+\>)+$")
-    this_tag = "init"
     ret = {}
-    for line in data_string_iter:
+    tag = "init"
+    lines_iter = iter(data_string_iter)
+    while True:
         # remove the enter \n at end of each line
-        line = line.rstrip("\n")
-        this_match = re_comp.match(line)
-        if this_match is not None:
-            this_tag = this_match.group()
-            if this_tag in __tag_class:
-                ret[this_tag] = __tag_class[this_tag]()
-            continue
-        if this_tag in __tag_class:
-            ret[this_tag].feed_line(line)
+        lines = [line.rstrip("\n")
+                 for line in islice(lines_iter, _BATCH_LINES)]
+        if not lines:
+            break
+        tag = _feed_batch(ret, tag, lines, columnar_mode)
     grid = gridcls.Grid(ret)
     return grid
+
+def _feed_batch(ret, tag, lines, columnar_mode):
+    """feed a batch of lines to the sections in `ret` (new sections are
+    added on their tag line), return the tag of the last section"""
+    start = 0
+    # only the lines starting with '<' may be tags
+    for index in [i for i, line in enumerate(lines) if line[:1] == "<"]:
+        this_match = _TAG_RE.match(lines[index])
+        if this_match is None:
+            continue
+        if start < index and tag in __tag_class:
+            ret[_section_tag(tag)].feed_lines(lines[start:index])
+        tag = this_match.group()
+        if _section_tag(tag) in __pos_tags:
+            ret[_section_tag(tag)] = __tag_class[tag](
+                columnar_mode=columnar_mode)
+        elif tag in __tag_class:
+            ret[tag] = __tag_class[tag]()
+        start = index + 1
+    if start < len(lines) and tag in __tag_class:
+        ret[_section_tag(tag)].feed_lines(lines[start:] if start else lines)
+    return tag
@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# results memoized over the hexagons of a map (flow fields, fields of view)
+# the results are kept in an LRU cache within a byte budget, the subclasses
+# drop the ones an edit of a floor or an item changes
+
+from collections import OrderedDict
+
+from . import gridcls
+
+WATCHED_TAGS = ("<floor>", "<item>")
+
+
+class MapCache:
+    """the base of the memoized queries over a `gridcls.Grid`, listening to
+    the <floor> and <item> sections (`_on_map_change`)
+    `budget`: bytes of the results (their `nbytes`), the least recently
+        used ones are dropped (the last one is always kept)"""
+
+    def __init__(self, grid: gridcls.Grid, budget=64 << 20):
+        self.grid = grid
+        self.budget = budget
+        self._cache = OrderedDict()     # key: result, LRU order
+        for tag in WATCHED_TAGS:
+            grid[tag].add_listener(self._on_map_change)
+
+    def close(self):
+        "stop listening to the map"
+        for tag in WATCHED_TAGS:
+            self.grid[tag].remove_listener(self._on_map_change)
+
+    def _on_map_change(self, tag, pos, row):
+        raise NotImplementedError
+
+    def _cached(self, key):
+        "the result of the key, None if it is not cached"
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+        return result
+
+    def _store(self, key, result):
+        "cache the result, drop the least recently used ones over budget"
+        self._cache[key] = result
+        used = sum(cached.nbytes for cached in self._cache.values())
+        while used > self.budget and len(self._cache) > 1:
+            used -= self._cache.popitem(last=False)[1].nbytes
+        return result
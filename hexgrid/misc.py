@@ -15,6 +15,12 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import bz2
+import gzip
+import lzma
+import os
+from contextlib import contextmanager
+
 from . import global_const
 
 # from .global_const import TERMCOLOR as COLOR
@@ -42,6 +48,67 @@ def unescape(txt: str):
     return txt
 
 
+# the stdlib codecs of the compressed files, found by their first bytes
+COMPRESSIONS = {"gzip": gzip.open, "bz2": bz2.open, "lzma": lzma.open}
+_COMPRESSION_MAGIC = (
+    (b"\x1f\x8b", "gzip"), (b"BZh", "bz2"), (b"\xfd7zXZ\x00", "lzma")
+)
+
+
+def compression_of(path):
+    "the compression of the file (a `COMPRESSIONS` key) or None"
+    with open(path, "rb") as file:
+        head = file.read(6)
+    for magic, name in _COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def open_file(path, mode="r", encoding=None, compress=None):
+    """open the file, streamed through the codec of `compress` (a
+    `COMPRESSIONS` key, None to open it as it is)"""
+    if compress is None:
+        return open(path, mode, encoding=encoding)
+    if compress not in COMPRESSIONS:
+        raise ValueError(f"unknown compression '{compress}'")
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    return COMPRESSIONS[compress](path, mode, encoding=encoding)
+
+
+def sync_dir(path):
+    """flush the entries of the directory (a file renamed in it) to the
+    disk, where the os has directory handles"""
+    if os.name == "nt":
+        return
+    fd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def replace_file(path, mode="w", encoding=None, compress=None):
+    """open a temporary file next to `path` for writing, it replaces `path`
+    only when the block ends without error, and is on the disk (its data
+    and the rename) when the block returns
+    `compress`: write it through a codec (see `open_file`)"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open_file(tmp_path, mode, encoding, compress) as file:
+            yield file
+        # the codecs write their last bytes on close, sync the file after
+        with open(tmp_path, "rb+") as file:
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        sync_dir(os.path.dirname(path))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def set_color(color, text) -> str:
     "set text color for terminal output"
     return f"{color}{text}{global_const.TERMCOLOR.DEFAULT}"
@@ -0,0 +1,291 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# shortest paths on the map
+# the cost of a step is the cost of *entering* the hexagon, given by the
+# color id of its floor (`CostTable`), hexagons with a blocking item type
+# (or an impassable color) cannot be entered
+
+import heapq
+from math import inf
+
+import numpy as np
+
+from . import gridcls, hexcoord, mapcache
+
+
+class CostTable:
+    """movement costs by floor color id (`MapSave.Color`)
+    `costs`: {color id (or "#rgb" in the palette): cost}, None or inf means
+        impassable
+    `default`: cost of hexagons without floor (or with an unlisted color)
+    `blocked_types`: item types (stamp ids) that block the hexagon"""
+
+    def __init__(self, costs=None, default=1.0, blocked_types=()):
+        self.costs = dict(costs or {})
+        self.default = default
+        self.blocked_types = frozenset(int(_t) for _t in blocked_types)
+
+    def resolve(self, palette):
+        "{color id: cost}, '#rgb' keys are looked up in the palette"
+        ret = {}
+        for key, cost in self.costs.items():
+            if isinstance(key, str) and key.startswith("#"):
+                key = palette.index(key)
+                if key is None:
+                    continue
+            ret[int(key)] = inf if cost is None else float(cost)
+        return ret
+
+
+class FlowField:
+    """result of a multi-source dijkstra: the cost from every hexagon to the
+    nearest source and the next step towards it"""
+
+    def __init__(self, finder, sources, dist, next_cell):
+        self.finder = finder
+        self.sources = sources
+        self.dist = dist            # flat float array, inf if unreachable
+        self.next_cell = next_cell  # flat int array, -1 on sources / walls
+        self._region = None
+
+    @property
+    def nbytes(self):
+        "bytes used by the arrays of the field"
+        return self.dist.nbytes + self.next_cell.nbytes + (
+            0 if self._region is None else self._region.nbytes)
+
+    @property
+    def region(self):
+        "bool mask of the hexagons whose change may change this field"
+        if self._region is None:
+            reached = np.isfinite(self.dist)
+            region = reached.copy()
+            nbr = self.finder.neighbor_table
+            valid = nbr >= 0
+            # a hexagon next to a reached one can open a new way
+            region[nbr[reached][valid[reached]]] = True
+            self._region = region
+        return self._region
+
+    def cost_at(self, pos):
+        "the cost from the pos to the nearest source (inf if unreachable)"
+        return float(self.dist[self.finder.cell_of(pos)])
+
+    def next_step(self, pos):
+        "the next pos towards the nearest source (None if there is none)"
+        nxt = int(self.next_cell[self.finder.cell_of(pos)])
+        if nxt < 0:
+            return None
+        return self.finder.pos_of(nxt)
+
+    def path_from(self, pos):
+        "the path (list of Pos) from the pos to the nearest source"
+        cell = self.finder.cell_of(pos)
+        if not np.isfinite(self.dist[cell]):
+            return None
+        ret = [self.finder.pos_of(cell)]
+        while self.next_cell[cell] >= 0:
+            cell = int(self.next_cell[cell])
+            ret.append(self.finder.pos_of(cell))
+        return ret
+
+
+class PathFinder(mapcache.MapCache):
+    """A* and cached flow fields over a `gridcls.Grid`, kept up to date by
+    listening to the <floor> and <item> sections
+    `budget`: bytes of the cached flow fields (see `mapcache.MapCache`)"""
+
+    def __init__(self, grid: gridcls.Grid, cost_table: CostTable = None,
+                 budget=64 << 20):
+        if cost_table is None:
+            cost_table = CostTable()
+        self.cost_table = cost_table
+        self.x_max = grid["<set>"].x_max
+        self.y_max = grid["<set>"].y_max
+        super().__init__(grid, budget)
+        self._build()
+        # '#rgb' costs follow the palette
+        grid["<color>"].add_listener(self._on_color_change)
+
+    def close(self):
+        super().close()
+        self.grid["<color>"].remove_listener(self._on_color_change)
+
+    # cells ###################################################################
+
+    def cell_of(self, pos):
+        "flat cell index of a Pos (or tuple (_x, _y))"
+        if isinstance(pos, gridcls.Pos):
+            pos = pos.pos_tuple
+        _x, _y = pos
+        if not (0 <= _x <= self.x_max and 1 <= _y <= self.y_max):
+            raise ValueError(f"pos {pos} is outside the map")
+        return _x * (self.y_max + 1) + _y
+
+    def pos_of(self, cell):
+        "the Pos of a flat cell index"
+        return gridcls.Pos(*divmod(int(cell), self.y_max + 1))
+
+    def _build(self):
+        n_cells = (self.x_max + 1) * (self.y_max + 1)
+        xs, ys = hexcoord.cell_xy(np.arange(n_cells), self.y_max)
+        self.neighbor_table = np.full((n_cells, 6), -1, dtype=np.int64)
+        src, cells = hexcoord.neighbors_batch(xs, ys, self.x_max, self.y_max)
+        # position of every neighbor in its row of the table
+        slot = np.arange(len(src)) - np.searchsorted(src, src)
+        self.neighbor_table[src, slot] = cells
+        self._color_costs = self.cost_table.resolve(self.grid["<color>"])
+
+        # cells outside the map (row 0) can never be entered
+        self.costs = np.full(n_cells, inf)
+        inside = hexcoord.in_map(xs, ys, self.x_max, self.y_max)
+        self.costs[inside] = self.cost_table.default
+        floors = self.grid["<floor>"].get_columns().array
+        for _x, _y, color in zip(floors["x"].tolist(), floors["y"].tolist(),
+                                 floors["color"].tolist()):
+            if 0 <= _x <= self.x_max and 1 <= _y <= self.y_max:
+                self.costs[_x * (self.y_max + 1) + _y] = \
+                    self._color_costs.get(int(color), self.cost_table.default)
+        items = self.grid["<item>"].get_columns().array
+        for _x, _y, _t in zip(items["x"].tolist(), items["y"].tolist(),
+                              items["type"].tolist()):
+            if (_t in self.cost_table.blocked_types
+                    and 0 <= _x <= self.x_max and 1 <= _y <= self.y_max):
+                self.costs[_x * (self.y_max + 1) + _y] = inf
+        finite = self.costs[np.isfinite(self.costs)]
+        self._min_cost = float(finite.min()) if len(finite) else 1.0
+
+    def _cell_cost(self, pos):
+        floor = self.grid["<floor>"].get_on_pos(pos)
+        if floor is None:
+            cost = self.cost_table.default
+        else:
+            cost = self._color_costs.get(int(floor.color),
+                                         self.cost_table.default)
+        item = self.grid["<item>"].get_on_pos(pos)
+        if item is not None and int(item.type) in \
+                self.cost_table.blocked_types:
+            cost = inf
+        return cost
+
+    def _on_map_change(self, _tag, pos, _row):
+        try:
+            cell = self.cell_of(pos)
+        except ValueError:
+            return
+        cost = self._cell_cost(pos)
+        if cost == self.costs[cell]:
+            return
+        self.costs[cell] = cost
+        self._min_cost = min(self._min_cost, cost)
+        for key in [key for key, field in self._cache.items()
+                    if field.region[cell]]:
+            del self._cache[key]
+
+    def _on_color_change(self, _tag, _color_id, _row):
+        if self.cost_table.resolve(self.grid["<color>"]) == self._color_costs:
+            return
+        self._build()
+        self._cache.clear()
+
+    # queries #################################################################
+
+    def astar(self, start, goal):
+        """shortest path from start to goal: (list of Pos, total cost),
+        None if the goal cannot be reached"""
+        start_cell = self.cell_of(start)
+        goal_cell = self.cell_of(goal)
+        costs = self.costs
+        nbr = self.neighbor_table
+        y_size = self.y_max + 1
+        goal_q, goal_r = hexcoord.offset_to_axial(*divmod(goal_cell, y_size))
+        min_cost = self._min_cost
+
+        def heuristic(cell):
+            _q, _r = hexcoord.offset_to_axial(*divmod(cell, y_size))
+            return hexcoord.axial_distance(_q, _r, goal_q, goal_r) * min_cost
+
+        best = {start_cell: 0.0}
+        came_from = {start_cell: -1}
+        heap = [(heuristic(start_cell), 0.0, start_cell)]
+        while heap:
+            _, dist, cell = heapq.heappop(heap)
+            if cell == goal_cell:
+                path = []
+                while cell >= 0:
+                    path.append(self.pos_of(cell))
+                    cell = came_from[cell]
+                path.reverse()
+                return (path, dist)
+            if dist > best[cell]:
+                continue
+            for nxt in nbr[cell].tolist():
+                if nxt < 0:
+                    continue
+                new_dist = dist + costs[nxt]
+                if new_dist < best.get(nxt, inf):
+                    best[nxt] = new_dist
+                    came_from[nxt] = cell
+                    heapq.heappush(
+                        heap, (new_dist + heuristic(nxt), new_dist, nxt))
+        return None
+
+    def flow_field(self, sources, max_cost=inf):
+        """one dijkstra pass from all the sources (Pos or (_x, _y)), cached
+        until a floor or item in its region changes"""
+        source_cells = tuple(sorted({self.cell_of(pos) for pos in sources}))
+        key = (source_cells, max_cost)
+        field = self._cached(key)
+        if field is not None:
+            return field
+        costs = self.costs
+        nbr = self.neighbor_table
+        dist = np.full(len(costs), inf)
+        next_cell = np.full(len(costs), -1, dtype=np.int64)
+        heap = []
+        for cell in source_cells:
+            dist[cell] = 0.0
+            heap.append((0.0, cell))
+        heapq.heapify(heap)
+        while heap:
+            cur, cell = heapq.heappop(heap)
+            if cur > dist[cell]:
+                continue
+            # walking from a neighbor into this cell costs costs[cell]
+            new_dist = cur + costs[cell]
+            if new_dist == inf or new_dist > max_cost:
+                continue
+            for prev in nbr[cell].tolist():
+                if prev >= 0 and new_dist < dist[prev]:
+                    dist[prev] = new_dist
+                    next_cell[prev] = cell
+                    heapq.heappush(heap, (new_dist, prev))
+        return self._store(
+            key, FlowField(self, source_cells, dist, next_cell))
+
+    def paths_for_players(self, goals, max_cost=inf):
+        "{player id: path to the nearest goal} with a single flow field"
+        field = self.flow_field(goals, max_cost=max_cost)
+        ret = {}
+        for player in self.grid["<player>"].get_data_iter():
+            try:
+                ret[player.id] = field.path_from(player.pos)
+            except ValueError:  # outside the map
+                ret[player.id] = None
+        return ret
@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# png file written band by band, the picture is never whole in memory
+#
+#   signature, IHDR (8 bit, RGB or RGBA, not interlaced), IDAT chunks of the
+#   zlib stream of the rows, IEND
+#
+# every row is "sub" filtered (the difference to the pixel on its left),
+# the flat colors of the map compress well with it
+
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_COLOR_TYPES = {"RGB": (2, 3), "RGBA": (6, 4)}     # mode: (type, bytes)
+_IDAT_BYTES = 1 << 16   # the compressed data is written in chunks this big
+
+
+def write_chunk(file, tag, data):
+    "write a png chunk (length, tag, data, crc)"
+    file.write(struct.pack(">I", len(data)))
+    file.write(tag)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(tag))))
+
+
+class PngWriter:
+    """write the rows of a png picture of the size to a file opened in binary
+    mode, `write` is called with the bands of the picture from the top
+    `mode`: "RGB" or "RGBA"
+    `level`: the zlib compression level"""
+
+    def __init__(self, file, size, mode="RGB", level=6):
+        if mode not in _COLOR_TYPES:
+            raise ValueError(f"unsupported png mode '{mode}'")
+        self.file = file
+        self.size = (int(size[0]), int(size[1]))
+        self.mode = mode
+        self.rows = 0   # written yet
+        self._compress = zlib.compressobj(level)
+        self._pending = []
+        self._pending_bytes = 0
+        color_type, self._bpp = _COLOR_TYPES[mode]
+        file.write(PNG_SIGNATURE)
+        write_chunk(file, b"IHDR", struct.pack(
+            ">IIBBBBB", self.size[0], self.size[1], 8, color_type, 0, 0, 0))
+
+    def write(self, band):
+        "append the rows of the band (a picture of the width and the mode)"
+        if band.mode != self.mode or band.size[0] != self.size[0]:
+            raise ValueError(f"band {band.mode} {band.size} does not fit "
+                             f"the {self.mode} {self.size} png")
+        if self.rows + band.size[1] > self.size[1]:
+            raise ValueError("more rows than the height of the png")
+        rows = np.asarray(band).reshape(band.size[1], -1)
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1),
+                            dtype=np.uint8)
+        filtered[:, 0] = 1  # sub
+        filtered[:, 1:self._bpp + 1] = rows[:, :self._bpp]
+        np.subtract(rows[:, self._bpp:], rows[:, :-self._bpp],
+                    out=filtered[:, self._bpp + 1:])
+        self._feed(self._compress.compress(filtered.tobytes()))
+        self.rows += band.size[1]
+
+    def _feed(self, data):
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+        if self._pending_bytes >= _IDAT_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            write_chunk(self.file, b"IDAT", b"".join(self._pending))
+            self._pending.clear()
+            self._pending_bytes = 0
+
+    def close(self):
+        "end the png, all the rows must be written"
+        if self.rows != self.size[1]:
+            raise ValueError(f"{self.rows} rows written of {self.size[1]}")
+        self._pending.append(self._compress.flush())
+        self._flush()
+        write_chunk(self.file, b"IEND", b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
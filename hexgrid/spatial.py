@@ -0,0 +1,121 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# spatial index of the markers (items and players) on the map
+# the markers are put in square buckets of `bucket_size` x `bucket_size`
+# hexagons (offset coordinates), a query only looks into the buckets that
+# overlap its bounding box
+
+from . import gridcls, hexcoord
+
+MARKER_TAGS = ("<item>", "<player>")
+
+
+def _xy(pos):
+    if isinstance(pos, gridcls.Pos):
+        return pos.pos_tuple
+    return (int(pos[0]), int(pos[1]))
+
+
+class MarkerIndex:
+    """bucketed index of the item and player rows by pos, kept up to date by
+    listening to the sections (add, move and remove)"""
+
+    def __init__(self, grid: gridcls.Grid, tags=MARKER_TAGS, bucket_size=8):
+        self.grid = grid
+        self.tags = tuple(tags)
+        self.bucket_size = int(bucket_size)
+        self._buckets = {}  # (bucket x, bucket y): {(tag, (_x, _y)): row}
+        for tag in self.tags:
+            section = grid[tag]
+            for row in section.get_data_iter():
+                key = _xy(row.pos)
+                # only the indexed row of a pos (the last one) is kept
+                self._put(tag, key, section.get_on_pos(key))
+            section.add_listener(self._on_marker_change)
+
+    def close(self):
+        "stop listening to the map"
+        for tag in self.tags:
+            self.grid[tag].remove_listener(self._on_marker_change)
+
+    def _bucket_of(self, key):
+        return (key[0] // self.bucket_size, key[1] // self.bucket_size)
+
+    def _put(self, tag, key, row):
+        bucket_key = self._bucket_of(key)
+        bucket = self._buckets.get(bucket_key)
+        if row is None:
+            if bucket is not None:
+                bucket.pop((tag, key), None)
+                if not bucket:
+                    del self._buckets[bucket_key]
+            return
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = {}
+        bucket[(tag, key)] = row
+
+    def _on_marker_change(self, tag, pos, row):
+        self._put(tag, _xy(pos), row)
+
+    def _in_box(self, x_0, y_0, x_1, y_1, tags):
+        "(tag, (_x, _y), row) of the markers in the box (corners included)"
+        size = self.bucket_size
+        if tags is None:
+            tags = self.tags
+        for b_x in range(x_0 // size, x_1 // size + 1):
+            for b_y in range(y_0 // size, y_1 // size + 1):
+                bucket = self._buckets.get((b_x, b_y))
+                if not bucket:
+                    continue
+                for (tag, key), row in bucket.items():
+                    if (tag in tags and x_0 <= key[0] <= x_1
+                            and y_0 <= key[1] <= y_1):
+                        yield (tag, key, row)
+
+    def at(self, pos, tags=None):
+        "[(tag, row)] of the markers on the pos"
+        _x, _y = _xy(pos)
+        return [(tag, row)
+                for tag, _, row in self._in_box(_x, _y, _x, _y, tags)]
+
+    def in_rect(self, pos_0, pos_1, tags=None):
+        "[(tag, row)] of the markers in the rectangle between two pos"
+        x_0, y_0 = _xy(pos_0)
+        x_1, y_1 = _xy(pos_1)
+        return [(tag, row) for tag, _, row in self._in_box(
+            min(x_0, x_1), min(y_0, y_1), max(x_0, x_1), max(y_0, y_1),
+            tags)]
+
+    def within(self, pos, radius: int, tags=None):
+        "[(tag, row)] of the markers within `radius` steps of the pos"
+        _x, _y = _xy(pos)
+        # one step changes the column or the row by at most 1
+        return [(tag, row) for tag, key, row in self._in_box(
+            _x - radius, _y - radius, _x + radius, _y + radius, tags)
+            if hexcoord.distance(_x, _y, key[0], key[1]) <= radius]
+
+    def on_ring(self, pos, radius: int, tags=None):
+        "[(tag, row)] of the markers exactly `radius` steps away"
+        _x, _y = _xy(pos)
+        return [(tag, row) for tag, key, row in self._in_box(
+            _x - radius, _y - radius, _x + radius, _y + radius, tags)
+            if hexcoord.distance(_x, _y, key[0], key[1]) == radius]
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
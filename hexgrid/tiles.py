@@ -0,0 +1,369 @@
+# -*- encoding: utf-8 -*-
+"""
+   Hexgrid by Thunderain Zhou
+   Copyright 2022 Thunderain Zhou
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# tiled storage of the maps too large to be held in memory
+# the floors, items and players are split into square tiles of
+# `tile_size` x `tile_size` hexagons (offset coordinates), every tile is a
+# small binary save (binsave.py) in the map directory:
+#
+#   <dir>/meta.hgbin                <set> <color> <user> and <tiles> (size)
+#   <dir>/tile_<tx>_<ty>.hgbin      <floor> <item> <player> of the tile
+#
+# only the tiles in use are kept in memory (LRU, within a byte budget), the
+# changed tiles are written back when they are dropped and on save
+
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+from . import binsave, columnar, gridcls, loadmap, misc
+
+TILE_TAGS = ("<floor>", "<item>", "<player>")
+META_TAGS = ("<set>", "<color>", "<user>")
+META_FILE = "meta.hgbin"
+_TILE_FILE = "tile_{0}_{1}.hgbin"
+_TILE_RE = re.compile(r"^tile_(-?\d+)_(-?\d+)\.hgbin$")
+_TILE_OVERHEAD = 4096   # bytes counted for every tile in memory
+
+_SECTION_CLASS = {
+    "<floor>": loadmap.MapSave.Floor,
+    "<item>": loadmap.MapSave.Item,
+    "<player>": loadmap.MapSave.Player,
+}
+
+
+def _tile_bytes(tile, tile_size):
+    # the pos index of a tile is at most tile_size x tile_size int32
+    return (_TILE_OVERHEAD + 4 * tile_size * tile_size
+            + sum(section.data.nbytes for section in tile.values()))
+
+
+def _new_section(tag, array, strings, origin):
+    section = _SECTION_CLASS[tag](columnar_mode=True)
+    if array is None:
+        array = np.zeros(0, dtype=section.codec_cls.dtype)
+    section.set_columns(array, strings, origin=origin)
+    return section
+
+
+def _write_tile(path, tile):
+    with misc.replace_file(path, mode="wb") as file:
+        binsave.write(file, tile, tags=TILE_TAGS)
+
+
+def _write_meta(path, grid, tile_size):
+    sections = {tag: grid[tag] for tag in META_TAGS}
+    sections["<tiles>"] = [f"{tile_size}\n"]
+    with misc.replace_file(os.path.join(path, META_FILE), mode="wb") as file:
+        binsave.write(file, sections, tags=META_TAGS + ("<tiles>",))
+
+
+class TileStore:
+    """the tiles of a map directory, loaded on demand and kept in an LRU
+    cache of at most `budget` bytes (the tile in use is always kept)"""
+
+    def __init__(self, path, tile_size=64, budget=256 << 20):
+        self.path = path
+        self.tile_size = int(tile_size)
+        self.budget = budget
+        self.strings = columnar.StringTable()    # shared by all the tiles
+        self.counts = {}    # (tx, ty): {tag: number of rows}, all the tiles
+        self._tiles = OrderedDict()     # (tx, ty): {tag: section}, LRU order
+        self._sizes = {}    # (tx, ty): bytes, of the tiles in memory
+        self._used = 0
+        self._dirty = set()
+        self.loads = 0      # tiles read from the disk
+        if os.path.isdir(path):
+            for name in os.listdir(path):
+                match = _TILE_RE.match(name)
+                if match is not None:
+                    self.counts[(int(match[1]), int(match[2]))] = \
+                        binsave.read_counts(os.path.join(path, name))
+
+    def tile_of(self, pos):
+        "the key (tx, ty) of the tile holding the pos"
+        if isinstance(pos, gridcls.Pos):
+            pos = pos.pos_tuple
+        return (pos[0] // self.tile_size, pos[1] // self.tile_size)
+
+    def tile_keys(self):
+        "the keys of all the tiles, in order"
+        return sorted(self.counts)
+
+    def count(self, tag):
+        "number of rows of the section in all the tiles"
+        return sum(counts.get(tag, 0) for counts in self.counts.values())
+
+    def _tile_path(self, key):
+        return os.path.join(self.path, _TILE_FILE.format(*key))
+
+    def _origin(self, key):
+        return (key[0] * self.tile_size, key[1] * self.tile_size)
+
+    def tile(self, key, create=False):
+        """{tag: section} of the tile, None if there is no such tile (and
+        `create` is False)"""
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+        if key in self.counts:
+            tile = self._load(key)
+        elif create:
+            tile = self._new_tile(key)
+            self.counts[key] = {tag: 0 for tag in TILE_TAGS}
+            self._dirty.add(key)
+        else:
+            return None
+        self._tiles[key] = tile
+        self._sizes[key] = _tile_bytes(tile, self.tile_size)
+        self._used += self._sizes[key]
+        self._evict()
+        return tile
+
+    def changed(self, key):
+        "the tile is changed: it must be written back, its size is updated"
+        tile = self._tiles[key]
+        self._dirty.add(key)
+        self.counts[key] = {
+            tag: len(section.data) for tag, section in tile.items()}
+        size = _tile_bytes(tile, self.tile_size)
+        self._used += size - self._sizes[key]
+        self._sizes[key] = size
+        # the tile in use is the last one, it is kept
+        self._evict()
+
+    def _new_tile(self, key):
+        return {tag: _new_section(tag, None, self.strings, self._origin(key))
+                for tag in TILE_TAGS}
+
+    def _load(self, key):
+        self.loads += 1
+        sections, strings = binsave.read(self._tile_path(key), {
+            tag: _SECTION_CLASS[tag].codec_cls.dtype for tag in TILE_TAGS})
+        remap = np.array([self.strings.intern(text) for text in strings],
+                         dtype=np.uint32)
+        tile = {}
+        for tag in TILE_TAGS:
+            array = sections.get(tag)
+            if array is not None and len(array):
+                for name in _SECTION_CLASS[tag].codec_cls.string_fields:
+                    # ids of the tile file -> ids of the shared table
+                    array[name] = remap[array[name]]
+            tile[tag] = _new_section(tag, array, self.strings,
+                                     self._origin(key))
+        return tile
+
+    def _write(self, key):
+        _write_tile(self._tile_path(key), self._tiles[key])
+        self._dirty.discard(key)
+
+    def _evict(self):
+        while self._used > self.budget and len(self._tiles) > 1:
+            key = next(iter(self._tiles))
+            if key in self._dirty:
+                self._write(key)
+            del self._tiles[key]
+            self._used -= self._sizes.pop(key)
+
+    def flush(self, grid):
+        "write the changed tiles and the other sections of the grid"
+        os.makedirs(self.path, exist_ok=True)
+        for key in list(self._dirty):
+            self._write(key)
+        _write_meta(self.path, grid, self.tile_size)
+
+
+class _TiledRows:
+    "list-like view of the rows of a tiled section, tile by tile"
+
+    def __init__(self, section):
+        self.section = section
+
+    def __len__(self):
+        return self.section.store.count(self.section.tag)
+
+    def __iter__(self):
+        for columns in self.section.iter_columns():
+            yield from columns
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        store = self.section.store
+        for key in store.tile_keys():
+            count = store.counts[key].get(self.section.tag, 0)
+            if index < count:
+                return store.tile(key)[self.section.tag].data[index]
+            index -= count
+        raise IndexError(index)
+
+
+class TiledSection(loadmap.PosSectionTemplate):
+    """a floor, item or player section kept in a `TileStore`, with the same
+    pos methods as the other sections (rows are added by `set_on_pos`)"""
+
+    def __init__(self, store: TileStore, tag):
+        super().__init__(tag)
+        self.store = store
+        self.codec_cls = _SECTION_CLASS[tag].codec_cls
+        self.data = _TiledRows(self)
+
+    @property
+    def is_columnar(self):
+        return True
+
+    def _tile_section(self, pos, create=False):
+        key = self.store.tile_of(pos)
+        tile = self.store.tile(key, create=create)
+        if tile is None:
+            return (key, None)
+        return (key, tile[self.tag])
+
+    def reindex(self, origin=(0, 0)):
+        "the tiles keep their own index"
+
+    def feed_lines(self, lines):
+        "the rows are put in their tiles"
+        section = _SECTION_CLASS[self.tag]()
+        section.feed_lines(lines)
+        self.set_many(section.data)
+
+    def has_pos(self, pos):
+        _, section = self._tile_section(pos)
+        return section is not None and section.has_pos(pos)
+
+    def get_on_pos(self, pos):
+        _, section = self._tile_section(pos)
+        if section is None:
+            return None
+        return section.get_on_pos(pos)
+
+    def set_on_pos(self, pos, data):
+        key, section = self._tile_section(pos, create=True)
+        section.set_on_pos(pos, data)
+        self.store.changed(key)
+        self._notify(data.pos, data)
+
+    def remove_on_pos(self, pos):
+        key, section = self._tile_section(pos)
+        if section is None:
+            return None
+        removed = section.remove_on_pos(pos)
+        if removed is not None:
+            self.store.changed(key)
+            self._notify(removed.pos, None)
+        return removed
+
+    def set_many(self, rows):
+        for row in rows:
+            self.set_on_pos(row.pos, row)
+
+    def set_records(self, array, strings=None):
+        decode = self.codec_cls(strings).decode
+        self.set_many([decode(record) for record in array.tolist()])
+
+    def iter_columns(self):
+        for key in self.store.tile_keys():
+            yield self.store.tile(key)[self.tag].data
+
+    def get_columns(self):
+        """all the rows in one `columnar.ColumnRows` (a copy, the string
+        ids are the ones of the store)"""
+        arrays = [columns.array for columns in self.iter_columns()]
+        array = np.concatenate(arrays) if arrays else \
+            np.zeros(0, dtype=self.codec_cls.dtype)
+        return columnar.ColumnRows.from_array(
+            self.codec_cls(self.store.strings), array)
+
+    def get_data_iter(self):
+        return iter(self.data)
+
+    def get_save_iter(self):
+        yield self.tag + "\n"
+        yield from self
+
+    def get_runs_iter(self):
+        "the save lines of the floors as runs (`loadmap.MapSave.FloorRuns`)"
+        return loadmap.floor_run_lines(self)
+
+    def __iter__(self):
+        for row in self.data:
+            yield "|".join(row) + "\n"
+
+
+class TiledGrid(gridcls.Grid):
+    "a `gridcls.Grid` whose floors, items and players are in a `TileStore`"
+
+    def __init__(self, store: TileStore, meta_sections: dict):
+        sections = {tag: meta_sections[tag] for tag in META_TAGS}
+        for tag in TILE_TAGS:
+            sections[tag] = TiledSection(store, tag)
+        super().__init__(sections)
+        self.store = store
+
+    def save(self, path=None, encoding="utf-8", binary=False, compress=None,
+             floor_runs=False):
+        """write the changed tiles back (no `path`, or the map directory),
+        or export the whole map as a single save file"""
+        if path is None or os.path.abspath(path) == \
+                os.path.abspath(self.store.path):
+            self.store.flush(self)
+            return
+        super().save(path, encoding=encoding, binary=binary,
+                     compress=compress, floor_runs=floor_runs)
+
+
+def open_tiles(path, budget=256 << 20):
+    "open a tiled map directory"
+    meta_path = os.path.join(path, META_FILE)
+    meta = loadmap.load_file(meta_path, use_journal=False)
+    tile_size = int(binsave.read(meta_path, {})[0]["<tiles>"][0])
+    return TiledGrid(TileStore(path, tile_size, budget), meta)
+
+
+def save_tiles(grid: gridcls.Grid, path, tile_size=64):
+    "write a map as a new tiled map directory"
+    if os.path.exists(os.path.join(path, META_FILE)):
+        raise FileExistsError(path)
+    os.makedirs(path, exist_ok=True)
+    tiles = {}  # (tx, ty): {tag: section}
+    for tag in TILE_TAGS:
+        columns = grid[tag].get_columns()
+        array = columns.array
+        t_x = array["x"] // tile_size
+        t_y = array["y"] // tile_size
+        # the rows of a tile stay in their order (lexsort is stable)
+        order = np.lexsort((t_y, t_x))
+        array, t_x, t_y = array[order], t_x[order], t_y[order]
+        starts = np.flatnonzero(np.r_[True, (t_x[1:] != t_x[:-1])
+                                      | (t_y[1:] != t_y[:-1])])
+        ends = np.r_[starts[1:], len(array)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            key = (int(t_x[start]), int(t_y[start]))
+            origin = (key[0] * tile_size, key[1] * tile_size)
+            tile = tiles.setdefault(key, {
+                other: _new_section(other, None, columns.codec.strings,
+                                    origin) for other in TILE_TAGS})
+            tile[tag] = _new_section(tag, array[start:end].copy(),
+                                     columns.codec.strings, origin)
+    for key, tile in tiles.items():
+        _write_tile(os.path.join(path, _TILE_FILE.format(*key)), tile)
+    _write_meta(path, grid, tile_size)
@@ -16,6 +16,75 @@
    limitations under the License.
 """
 
+import unittest
+
+from hexgrid import create_grid_pic, gridcls, loadmap
+
+# `make test` runs the test cases below
+_DUPLICATE_FLOORS = """\
+GRIDMAP 0.1
+<set>
+3|3|20|"duplicates"
+<color>
+#0F3256
+#557C50
+#638F9A
+<floor>
+B2|0
+A1|1
+A1|2
+<item>
+<user>
+<player>
+"""
+
+
+class DuplicatePosTest(unittest.TestCase):
+    "the last row of a pos wins, in memory and in the saved file"
+
+    def test_remove_keeps_last_row(self):
+        for columnar_mode in (False, True):
+            grid = loadmap.init_map_data(_DUPLICATE_FLOORS.splitlines(),
+                                         columnar_mode=columnar_mode)
+            floors = grid["<floor>"]
+            self.assertEqual(len(floors.data), 2)
+            floors.remove_on_pos(gridcls.Pos("B2"))
+            self.assertEqual(
+                int(floors.get_on_pos(gridcls.Pos("A1")).color), 2)
+            lines = "".join(floors.get_save_iter()).splitlines()
+            self.assertEqual(lines, ["<floor>", "A1|2"])
+
+    def test_refresh_matches_full_render(self):
+        # 12x12 map, every floor pos given twice with another color
+        lines = _DUPLICATE_FLOORS.splitlines()
+        lines[2] = '12|12|20|"duplicates"'
+        floors = [f"{gridcls.Pos(_x, _y).show_pos}|{(_x + _y + rep) % 3}"
+                  for rep in range(2) for _x in range(1, 13)
+                  for _y in range(1, 13)]
+        lines[8:11] = floors
+        edits = [("set", (2, 3)), ("move", (5, 5), (2, 3)),
+                 ("remove", (7, 8)), ("move", (9, 9), (7, 8)),
+                 ("set", (5, 5)), ("remove", (1, 1))]
+        for columnar_mode in (False, True):
+            grid = loadmap.init_map_data(lines, columnar_mode=columnar_mode)
+            canvas = create_grid_pic.MapCanvas(grid)
+            canvas.refresh()
+            section = grid["<floor>"]
+            for edit in edits:
+                pos = gridcls.Pos(*edit[1])
+                if edit[0] == "set":
+                    section.set_on_pos(pos, gridcls.Node.Floor(pos, 0))
+                elif edit[0] == "move":
+                    section.move_on_pos(pos, edit[2])
+                else:
+                    section.remove_on_pos(pos)
+            # the dirty boxes only, not the whole map again
+            self.assertGreater(canvas.refresh(), 1)
+            full = create_grid_pic.MapCanvas(grid)
+            full.refresh()
+            self.assertEqual(canvas.image.tobytes(), full.image.tobytes())
+
+
 if __name__ == "__main__":
     from hexgrid import command_ui
     term = command_ui.MapEditInterface()